@@ -1,63 +1,75 @@
 import os
-from flask import Flask, render_template, jsonify, request
+from flask import Blueprint, Flask, Response, render_template, jsonify, request
 import json
 from datetime import datetime, timedelta
-from database import db
+from database import db, ORDER_STATUS_TRANSITIONS
 import config
+import metrics
+import archive
 try:
     from zoneinfo import ZoneInfo
     TZ = ZoneInfo('Asia/Tashkent')
 except Exception:
     TZ = None
 
-app = Flask(__name__)
+admin = Blueprint('admin', __name__)
 
-@app.route('/admin')
+@admin.route('/admin')
 def admin_dashboard():
     return render_template('admin.html')
 
-@app.route('/api/orders')
+def serialize_order(order):
+    # Приводим время к часовому поясу Ташкента для отображения
+    created_at_display = None
+    printed_at_display = None
+    if order.created_at:
+        if TZ is not None:
+            # order.created_at хранится в UTC (naive) — делаем aware UTC, затем конвертируем
+            created_utc = order.created_at.replace(tzinfo=ZoneInfo('UTC'))
+            created_at_display = created_utc.astimezone(TZ).strftime('%Y-%m-%d %H:%M:%S')
+        else:
+            created_at_display = order.created_at.strftime('%Y-%m-%d %H:%M:%S')
+
+    if order.printed_at:
+        if TZ is not None:
+            printed_utc = order.printed_at.replace(tzinfo=ZoneInfo('UTC'))
+            printed_at_display = printed_utc.astimezone(TZ).strftime('%Y-%m-%d %H:%M:%S')
+        else:
+            printed_at_display = order.printed_at.strftime('%Y-%m-%d %H:%M:%S')
+
+    return {
+        'id': order.id,
+        'customer': f"{order.first_name} (@{order.username})" if order.username else order.first_name,
+        'phone': order.phone,
+        'address': order.address,
+        'items': eval(order.items) if order.items else [],
+        'total_amount': order.total_amount,
+        'status': order.status,
+        'version': order.version or 0,
+        'created_at': created_at_display,
+        'printed_at': printed_at_display
+    }
+
+@admin.route('/api/orders')
 def get_orders():
     status = request.args.get('status')
     limit = int(request.args.get('limit', 50))
     
     orders = db.get_orders(status=status, limit=limit)
     
-    orders_data = []
-    for order in orders:
-        # Приводим время к часовому поясу Ташкента для отображения
-        created_at_display = None
-        printed_at_display = None
-        if order.created_at:
-            if TZ is not None:
-                # order.created_at хранится в UTC (naive) — делаем aware UTC, затем конвертируем
-                created_utc = order.created_at.replace(tzinfo=ZoneInfo('UTC'))
-                created_at_display = created_utc.astimezone(TZ).strftime('%Y-%m-%d %H:%M:%S')
-            else:
-                created_at_display = order.created_at.strftime('%Y-%m-%d %H:%M:%S')
-
-        if order.printed_at:
-            if TZ is not None:
-                printed_utc = order.printed_at.replace(tzinfo=ZoneInfo('UTC'))
-                printed_at_display = printed_utc.astimezone(TZ).strftime('%Y-%m-%d %H:%M:%S')
-            else:
-                printed_at_display = order.printed_at.strftime('%Y-%m-%d %H:%M:%S')
+    return jsonify([serialize_order(order) for order in orders])
 
-        orders_data.append({
-            'id': order.id,
-            'customer': f"{order.first_name} (@{order.username})" if order.username else order.first_name,
-            'phone': order.phone,
-            'address': order.address,
-            'items': eval(order.items) if order.items else [],
-            'total_amount': order.total_amount,
-            'status': order.status,
-            'created_at': created_at_display,
-            'printed_at': printed_at_display
-        })
+@admin.route('/api/orders/search')
+def search_orders():
+    """Поиск по имени, @username, телефону и адресу"""
+    query = request.args.get('q', '').strip()
+    limit = int(request.args.get('limit', 50))
+    
+    orders = db.search_orders(query, limit=limit) if query else []
     
-    return jsonify(orders_data)
+    return jsonify([serialize_order(order) for order in orders])
 
-@app.route('/api/stats')
+@admin.route('/api/stats')
 def get_stats():
     # Статистика за сегодня
     today_stats = db.get_today_stats()
@@ -85,19 +97,57 @@ def get_stats():
         'statuses': status_stats
     })
 
-@app.route('/api/order/<int:order_id>/status', methods=['POST'])
+def _parse_date_arg(name):
+    value = request.args.get(name)
+    return datetime.strptime(value, '%Y-%m-%d') if value else None
+
+@admin.route('/api/orders/export')
+def export_orders():
+    """Выгрузка заказов за период (включая архив) в формате NDJSON"""
+    start = _parse_date_arg('from')
+    end = _parse_date_arg('to')
+    status = request.args.get('status')
+    
+    def generate():
+        for row in archive.iter_all_orders(db, start=start, end=end, status=status):
+            yield json.dumps(row, ensure_ascii=False) + '\n'
+    
+    return Response(generate(), mimetype='application/x-ndjson',
+                    headers={'Content-Disposition': 'attachment; filename=orders.ndjson'})
+
+@admin.route('/api/stats/monthly')
+def get_monthly_stats():
+    """Заказы и выручка по месяцам с учётом архива"""
+    return jsonify(archive.monthly_summary(db, start=_parse_date_arg('from'), end=_parse_date_arg('to')))
+
+@admin.route('/api/order/<int:order_id>/status', methods=['POST'])
 def update_order_status(order_id):
     data = request.json
     new_status = data.get('status')
+    version = data.get('version')
     
-    if new_status in ['new', 'confirmed', 'printed', 'cancelled']:
-        success = db.update_order_status(order_id, new_status)
+    if new_status in ORDER_STATUS_TRANSITIONS:
+        success = db.submit_status_update(order_id, new_status, expected_version=version).result()
         if success:
             return jsonify({'status': 'success'})
+        if db.get_order(order_id):
+            # Заказ изменили параллельно (бот или другой админ) — пусть клиент перечитает список
+            return jsonify({'status': 'conflict'}), 409
     
     return jsonify({'status': 'error'}), 400
 
+@admin.route('/metrics')
+def prometheus_metrics():
+    return Response(metrics.generate_latest(), mimetype=metrics.CONTENT_TYPE_LATEST)
+
+def create_admin_app():
+    """Создаёт Flask-приложение админ-панели"""
+    app = Flask(__name__)
+    app.register_blueprint(admin)
+    return app
+
 if __name__ == '__main__':
+    app = create_admin_app()
     port = int(os.getenv('PORT', '8080'))
     debug = os.getenv('FLASK_DEBUG', 'false').lower() in ('1', 'true', 'yes')
     # use_reloader=False because we run Flask inside a thread when using start.py
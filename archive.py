@@ -0,0 +1,200 @@
+"""Архивация старых заказов.
+
+Заказы старше ARCHIVE_AFTER_DAYS переносятся из таблицы orders в таблицу
+orders_archive отдельной базы ARCHIVE_DATABASE_URL (например, SQLite-файл на том же
+volume). Освободившиеся страницы основной базы переиспользуются новыми заказами,
+поэтому её файл перестаёт расти, а рабочая таблица, индексы и поиск остаются
+маленькими. Архивация выключена, пока не заданы ARCHIVE_AFTER_DAYS и ARCHIVE_DATABASE_URL.
+
+Запуск вручную:
+    python archive.py --days 180
+"""
+import argparse
+import asyncio
+import logging
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, func, insert, literal_column, select, text
+from sqlalchemy.orm import sessionmaker
+
+import config
+from database import ArchiveBase, Order, OrderArchive, OutboxMessage
+
+logger = logging.getLogger(__name__)
+
+ORDER_FIELDS = [column.name for column in Order.__table__.columns]
+
+_archive_engines = {}
+_archive_lock = threading.Lock()
+
+
+def order_to_dict(order):
+    data = {}
+    for field in ORDER_FIELDS:
+        value = getattr(order, field)
+        data[field] = value.isoformat() if isinstance(value, datetime) else value
+    return data
+
+
+def get_archive_engine(url=None):
+    """Подключение к базе архива (создаёт таблицу orders_archive). None, если ARCHIVE_DATABASE_URL не задан."""
+    url = url or config.Config.ARCHIVE_DATABASE_URL
+    if not url:
+        return None
+    with _archive_lock:
+        if url not in _archive_engines:
+            engine = create_engine(url)
+            ArchiveBase.metadata.create_all(engine)
+            _archive_engines[url] = engine
+        return _archive_engines[url]
+
+
+def archive_orders(db, older_than_days=None, batch_size=500, archive_url=None, vacuum=False):
+    """Переносит заказы старше older_than_days в базу архива. Возвращает число перенесённых заказов."""
+    older_than_days = older_than_days if older_than_days is not None else config.Config.ARCHIVE_AFTER_DAYS
+    if older_than_days <= 0:
+        return 0
+    archive_engine = get_archive_engine(archive_url)
+    if archive_engine is None:
+        raise RuntimeError("ARCHIVE_DATABASE_URL не задан — некуда переносить заказы")
+
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    # Отдельная сессия: архивация может идти в другом потоке, чем бот и админка
+    session = sessionmaker(bind=db.engine)()
+    archived = 0
+    try:
+        while True:
+            orders = session.query(Order).filter(Order.created_at < cutoff).order_by(Order.id).limit(batch_size).all()
+            if not orders:
+                break
+
+            ids = [order.id for order in orders]
+            archived_at = datetime.utcnow()
+            rows = [dict({field: getattr(order, field) for field in ORDER_FIELDS}, archived_at=archived_at)
+                    for order in orders]
+            # Сначала фиксируем копию в архиве, только потом удаляем из основной базы.
+            # Если процесс упадёт между этими шагами, при следующем запуске уже скопированные заказы пропускаются.
+            with archive_engine.begin() as conn:
+                present = set(conn.execute(select(OrderArchive.id).where(OrderArchive.id.in_(ids))).scalars())
+                rows = [row for row in rows if row['id'] not in present]
+                if rows:
+                    conn.execute(insert(OrderArchive), rows)
+
+            session.query(OutboxMessage).filter(
+                OutboxMessage.order_id.in_(ids), OutboxMessage.sent_at.isnot(None)
+            ).delete(synchronize_session=False)
+            session.query(Order).filter(Order.id.in_(ids)).delete(synchronize_session=False)
+            session.commit()
+            archived += len(ids)
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+    if vacuum and archived and db.engine.dialect.name == 'sqlite':
+        # VACUUM сразу уменьшает файл, но блокирует базу — только по явному запросу
+        with db.engine.connect() as conn:
+            conn.execution_options(isolation_level='AUTOCOMMIT').execute(text('VACUUM'))
+
+    if archived:
+        logger.info(f"Archived {archived} orders older than {cutoff:%Y-%m-%d}")
+    return archived
+
+
+def _query_orders(session, model, start=None, end=None, status=None):
+    query = session.query(model).order_by(model.id)
+    if start is not None:
+        query = query.filter(model.created_at >= start)
+    if end is not None:
+        query = query.filter(model.created_at < end)
+    if status:
+        query = query.filter(model.status == status)
+    return query
+
+
+def iter_archived_orders(start=None, end=None, status=None, archive_url=None):
+    """Заказы из архива (словари, как в order_to_dict) с created_at в [start, end)"""
+    archive_engine = get_archive_engine(archive_url)
+    if archive_engine is None:
+        return
+    session = sessionmaker(bind=archive_engine)()
+    try:
+        for order in _query_orders(session, OrderArchive, start, end, status).yield_per(500):
+            yield order_to_dict(order)
+    finally:
+        session.close()
+
+
+def iter_all_orders(db, start=None, end=None, status=None):
+    """Архивные, затем актуальные заказы за период — для экспорта и аналитики"""
+    yield from iter_archived_orders(start, end, status)
+
+    session = sessionmaker(bind=db.engine)()
+    try:
+        for order in _query_orders(session, Order, start, end, status).yield_per(500):
+            yield order_to_dict(order)
+    finally:
+        session.close()
+
+
+def _month(engine, column):
+    """Выражение 'YYYY-MM' для created_at в диалекте базы.
+    Константы — литералы, а не параметры: иначе SELECT и GROUP BY могут не совпасть.
+    """
+    if engine.dialect.name == 'postgresql':
+        return func.to_char(func.date_trunc(literal_column("'month'"), column), literal_column("'YYYY-MM'"))
+    return func.strftime(literal_column("'%Y-%m'"), column)
+
+
+def _monthly_rows(engine, model, start=None, end=None):
+    """(месяц, статус, число заказов, выручка) — группировка выполняется в базе"""
+    month = _month(engine, model.created_at).label('month')
+    query = select(month, model.status, func.count(model.id), func.coalesce(func.sum(model.total_amount), 0))
+    if start is not None:
+        query = query.where(model.created_at >= start)
+    if end is not None:
+        query = query.where(model.created_at < end)
+    with engine.connect() as conn:
+        return conn.execute(query.group_by(month, model.status)).all()
+
+
+def monthly_summary(db, start=None, end=None):
+    """Число заказов и выручка по месяцам с учётом архива"""
+    rows = _monthly_rows(db.engine, Order, start, end)
+    archive_engine = get_archive_engine()
+    if archive_engine is not None:
+        rows += _monthly_rows(archive_engine, OrderArchive, start, end)
+
+    summary = {}
+    for month, status, orders, revenue in rows:
+        stats = summary.setdefault(month or 'unknown', {'orders': 0, 'revenue': 0, 'by_status': {}})
+        stats['orders'] += orders
+        stats['revenue'] += revenue
+        stats['by_status'][status] = stats['by_status'].get(status, 0) + orders
+    return dict(sorted(summary.items()))
+
+
+async def run_archiver(db, interval_hours=None):
+    """Фоновая задача: раз в interval_hours переносит старые заказы в архив"""
+    interval_hours = interval_hours or config.Config.ARCHIVE_INTERVAL_HOURS
+    while True:
+        try:
+            await asyncio.to_thread(archive_orders, db)
+        except Exception as e:
+            logger.error(f"Archive error: {e}")
+        await asyncio.sleep(interval_hours * 3600)
+
+
+if __name__ == '__main__':
+    from database import db
+
+    parser = argparse.ArgumentParser(description="Перенос старых заказов в архив")
+    parser.add_argument('--days', type=int, default=config.Config.ARCHIVE_AFTER_DAYS, help="Архивировать заказы старше N дней")
+    parser.add_argument('--vacuum', action='store_true', help="Выполнить VACUUM для SQLite после архивации")
+    args = parser.parse_args()
+
+    from logging_setup import setup_logging
+    setup_logging('archive')
+    print(f"Перенесено в архив: {archive_orders(db, args.days, vacuum=args.vacuum)}")
@@ -0,0 +1,261 @@
+"""Нагрузочный бенчмарк сценария заказа.
+
+Прогоняет синтетические апдейты через dp.feed_update для тысяч пользователей
+(start -> prod_N -> checkout -> print_) без обращения к Telegram и принтеру.
+Все исходящие вызовы API записываются фейковой сессией, заказы пишутся во
+временную SQLite-базу.
+
+Пример:
+    python benchmark.py --users 2000 --concurrency 100
+"""
+import argparse
+import asyncio
+import itertools
+import logging
+import os
+import random
+import statistics
+import tempfile
+import time
+from collections import Counter, defaultdict
+from datetime import datetime
+
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+class FakeResponse:
+    status_code = 200
+    text = '{"status": "success"}'
+
+    def json(self):
+        return {"status": "success"}
+
+
+class Benchmark:
+    def __init__(self, users, concurrency, taps, print_orders, real_printer, seed, workers=0):
+        self.users = users
+        self.concurrency = concurrency
+        self.taps = taps
+        self.print_orders = print_orders
+        self.real_printer = real_printer
+        self.workers = workers
+        self.update_queue = None
+        self.random = random.Random(seed)
+        self.update_ids = itertools.count(1)
+        self.message_ids = itertools.count(1)
+        self.handler_latency = defaultdict(list)
+        self.handler_errors = Counter()
+        # Сколько апдейтов каждого пользователя уже обработано (с очередью воркеров — не сразу после feed)
+        self.processed = Counter()
+        self.update_latency = []
+        self.outbox_elapsed = 0.0
+
+    def setup(self):
+        # Импорт откладывается, чтобы бот увидел временную БД из окружения
+        from aiogram import BaseMiddleware
+        from aiogram.client.session.base import BaseSession
+        from aiogram.methods import SendMessage
+        from aiogram.types import Chat, Message
+        import bot as bot_module
+        import config
+        import metrics
+
+        benchmark = self
+
+        class RecordingSession(BaseSession):
+            """Сессия, которая записывает вызовы API вместо отправки в Telegram"""
+
+            def __init__(self):
+                super().__init__()
+                self.calls = Counter()
+                self.order_ids = []
+
+            async def close(self):
+                pass
+
+            async def make_request(self, bot, method, timeout=None):
+                self.calls[type(method).__name__] += 1
+                if isinstance(method, SendMessage):
+                    markup = method.reply_markup
+                    if markup is not None and getattr(markup, 'inline_keyboard', None):
+                        for row in markup.inline_keyboard:
+                            for button in row:
+                                if button.callback_data and button.callback_data.startswith('print_'):
+                                    self.order_ids.append(int(button.callback_data.split('_')[1]))
+                    return Message(
+                        message_id=next(benchmark.message_ids),
+                        date=datetime.now(),
+                        chat=Chat(id=0, type='channel'),
+                        text=method.text,
+                    )
+                return True
+
+            async def stream_content(self, *args, **kwargs):
+                raise NotImplementedError("Скачивание файлов в бенчмарке не используется")
+
+        class TimingMiddleware(BaseMiddleware):
+            async def __call__(self, handler, event, data):
+                name = metrics._handler_name(data)
+                start = time.perf_counter()
+                try:
+                    return await handler(event, data)
+                except Exception:
+                    benchmark.handler_errors[name] += 1
+                    raise
+                finally:
+                    benchmark.handler_latency[name].append(time.perf_counter() - start)
+                    benchmark.processed[event.from_user.id] += 1
+
+        self.bot_module = bot_module
+        self.config = config
+        self.session = RecordingSession()
+        self.bot = bot_module.create_bot(session=self.session)
+        bot_module.dp.message.middleware(TimingMiddleware())
+        bot_module.dp.callback_query.middleware(TimingMiddleware())
+
+        # Как в bot.main: апдейты раскладываются по воркерам по пользователю
+        if self.workers:
+            from update_queue import ShardedUpdateMiddleware
+            self.update_queue = ShardedUpdateMiddleware(workers=self.workers)
+            bot_module.dp.update.outer_middleware(self.update_queue)
+
+        # По умолчанию печать уходит в фейковый принтер (выключатель и трассировка клиента остаются в работе)
+        if not self.real_printer:
+            bot_module.printer_client._post = lambda *args, **kwargs: FakeResponse()
+
+    def _user(self, user_id):
+        return {'id': user_id, 'is_bot': False, 'first_name': f'User{user_id}', 'username': f'user{user_id}'}
+
+    def _message(self, user_id, text, message_id=None):
+        return {
+            'message_id': message_id or next(self.message_ids),
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': self._user(user_id),
+            'text': text,
+        }
+
+    def _callback(self, user_id, data, chat_id=None, message_id=None):
+        return {
+            'id': str(next(self.update_ids)),
+            'from': self._user(user_id),
+            'chat_instance': str(chat_id or user_id),
+            'data': data,
+            'message': self._message(chat_id or user_id, 'Сообщение с кнопками', message_id),
+        }
+
+    async def feed(self, payload):
+        from aiogram.types import Update
+
+        bot = self.bot
+        update = Update.model_validate({'update_id': next(self.update_ids), **payload}, context={'bot': bot})
+        start = time.perf_counter()
+        try:
+            await self.bot_module.dp.feed_update(bot, update)
+        finally:
+            self.update_latency.append(time.perf_counter() - start)
+
+    async def customer_flow(self, user_id, semaphore):
+        async with semaphore:
+            await self.feed({'message': self._message(user_id, '/start')})
+            await self.feed({'message': self._message(user_id, '🛍️ Заказать товары')})
+            # Все нажатия приходят с одного и того же сообщения-каталога, как у живого покупателя
+            cart_message_id = next(self.message_ids)
+            product_count = len(self.config.Products.ITEMS)
+            for _ in range(self.taps):
+                data = f'prod_{self.random.randint(1, product_count)}'
+                await self.feed({'callback_query': self._callback(user_id, data, message_id=cart_message_id)})
+            # Кнопка «Оформить заказ» появляется только после перерисовки корзины:
+            # дожидаемся обработки всех нажатий и перерисовываем корзину, не ожидая задержки
+            while self.processed[user_id] < 2 + self.taps:
+                await asyncio.sleep(0.001)
+            await self.bot_module.cart_edits.flush((user_id, cart_message_id))
+            await self.feed({'callback_query': self._callback(user_id, 'checkout', message_id=cart_message_id)})
+
+    async def admin_flow(self, order_id, semaphore):
+        admin_id = self.config.Config.ADMIN_IDS[0]
+        async with semaphore:
+            await self.feed({'callback_query': self._callback(admin_id, f'print_{order_id}', chat_id=-100)})
+
+    async def run(self):
+        semaphore = asyncio.Semaphore(self.concurrency)
+        start = time.perf_counter()
+        await asyncio.gather(*(self.customer_flow(100000 + i, semaphore) for i in range(self.users)))
+        if self.update_queue:
+            await self.update_queue.join()
+        await self.bot_module.cart_edits.flush()
+        # Посты в канал уходят через outbox — отправляем их без ограничения частоты
+        from outbox import OutboxSender
+        sender = OutboxSender(self.bot, self.bot_module.db, rate_per_minute=1e9, burst=1e9)
+        outbox_start = time.perf_counter()
+        await sender.drain()
+        self.outbox_elapsed = time.perf_counter() - outbox_start
+        if self.print_orders:
+            await asyncio.gather(*(self.admin_flow(order_id, semaphore) for order_id in self.session.order_ids))
+            if self.update_queue:
+                await self.update_queue.join()
+        return time.perf_counter() - start
+
+    def report(self, elapsed):
+        updates = len(self.update_latency)
+        lines = [
+            f"Пользователей: {self.users}, параллельно: {self.concurrency}",
+            f"Апдейтов: {updates} за {elapsed:.2f} с — {updates / elapsed:.1f} апдейтов/с",
+            f"Заказов оформлено: {len(self.session.order_ids)}, "
+            f"отправка outbox в канал: {self.outbox_elapsed:.2f} с",
+            f"Апдейт целиком: p50={percentile(self.update_latency, 50) * 1000:.2f} мс, "
+            f"p99={percentile(self.update_latency, 99) * 1000:.2f} мс",
+            "",
+            f"{'Обработчик':<24}{'вызовов':>9}{'ошибок':>8}{'p50, мс':>10}{'p99, мс':>10}{'сред., мс':>11}",
+        ]
+        for name, samples in sorted(self.handler_latency.items()):
+            lines.append(
+                f"{name:<24}{len(samples):>9}{self.handler_errors[name]:>8}"
+                f"{percentile(samples, 50) * 1000:>10.2f}{percentile(samples, 99) * 1000:>10.2f}"
+                f"{statistics.fmean(samples) * 1000:>11.2f}"
+            )
+        lines.append("")
+        lines.append("Вызовы Telegram API: " + ", ".join(f"{k}={v}" for k, v in sorted(self.session.calls.items())))
+        return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный бенчмарк оформления заказа")
+    parser.add_argument('--users', type=int, default=1000, help="Количество симулируемых покупателей")
+    parser.add_argument('--concurrency', type=int, default=50, help="Сколько покупателей действуют одновременно")
+    parser.add_argument('--taps', type=int, default=3, help="Сколько товаров добавляет каждый покупатель")
+    parser.add_argument('--no-print', action='store_true', help="Не прогонять печать чеков")
+    parser.add_argument('--real-printer', action='store_true', help="Отправлять чеки на PRINTER_API_URL")
+    parser.add_argument('--workers', type=int, default=0,
+                        help="Пропускать апдейты через очередь с N воркерами, как в боевом режиме "
+                             "(время апдейта тогда — только постановка в очередь)")
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix='konditer_bench_')
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tmpdir, 'bench.db')}"
+    # Токен нужен только для создания Bot — в Telegram ничего не уходит
+    if not os.getenv('BOT_TOKEN'):
+        os.environ['BOT_TOKEN'] = '123456:BENCHMARK'
+    if not os.getenv('ADMIN_IDS'):
+        os.environ['ADMIN_IDS'] = '1'
+
+    benchmark = Benchmark(args.users, args.concurrency, args.taps, not args.no_print, args.real_printer, args.seed, args.workers)
+    benchmark.setup()
+    # Логи каждого апдейта искажают замеры
+    logging.getLogger('aiogram').setLevel(logging.WARNING)
+    logging.getLogger('bot').setLevel(logging.WARNING)
+
+    elapsed = asyncio.run(benchmark.run())
+    print(benchmark.report(elapsed))
+    print(f"\nВременная БД: {os.environ['DATABASE_URL']}")
+
+
+if __name__ == '__main__':
+    main()
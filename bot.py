@@ -1,10 +1,13 @@
 import asyncio
 import logging
 import json
+from contextlib import asynccontextmanager
+from functools import lru_cache
 from aiogram import Bot, Dispatcher, types, F
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.filters import Command
-from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardMarkup, KeyboardButton
-import requests
+from aiogram.types import (InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardMarkup, KeyboardButton,
+                           InlineQueryResultArticle, InputTextMessageContent)
 from datetime import datetime
 try:
     from zoneinfo import ZoneInfo
@@ -13,25 +16,45 @@ except Exception:
     TZ = None
 
 import config
-from database import db
-
-# Настройка логирования
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+import tracing
+from catalog import Catalog
+from logging_setup import setup_logging
+from database import db, ORDER_STATUS_TRANSITIONS
+from metrics import MetricsMiddleware
+from outbox import OutboxSender
+from printer_client import PrinterClient, PrinterUnavailable
+from throttling import Debouncer, ThrottlingMiddleware
+from update_queue import ShardedUpdateMiddleware
 
 logger = logging.getLogger(__name__)
 
-# Проверяем токен
-print(f"Bot token: {config.Config.BOT_TOKEN[:10]}...")
+dp = Dispatcher()
 
-try:
-    bot = Bot(token=config.Config.BOT_TOKEN)
-    dp = Dispatcher()
-except Exception as e:
-    print(f"Ошибка создания бота: {e}")
-    exit(1)
+def create_bot(token=None, session=None):
+    """Создаёт экземпляр Bot. Вызывается при запуске, а не при импорте модуля."""
+    token = token or config.Config.BOT_TOKEN
+    # Проверяем токен
+    logger.info(f"Bot token: {token[:10]}...")
+    return Bot(token=token, session=session)
+
+# Отложенная перерисовка корзины: серия нажатий на товары даёт одно редактирование сообщения
+cart_edits = Debouncer(config.Config.CART_EDIT_DEBOUNCE_SECONDS)
+
+# Печать чеков: при недоступном принтере нажатия отклоняются сразу, а не по таймауту
+printer_client = PrinterClient()
+
+# Trace id на каждый апдейт (регистрируется первым, чтобы покрыть остальные middleware)
+dp.message.middleware(tracing.TracingMiddleware())
+dp.callback_query.middleware(tracing.TracingMiddleware())
+dp.inline_query.middleware(tracing.TracingMiddleware())
+
+# Метрики времени и ошибок обработчиков
+dp.message.middleware(MetricsMiddleware())
+dp.callback_query.middleware(MetricsMiddleware())
+dp.inline_query.middleware(MetricsMiddleware())
+
+# Повторные нажатия одной кнопки отбрасываются
+dp.callback_query.middleware(ThrottlingMiddleware(cart_edits))
 
 def get_main_keyboard():
     """Основная клавиатура"""
@@ -43,26 +66,79 @@ def get_main_keyboard():
         resize_keyboard=True
     )
 
-def get_products_keyboard():
-    """Клавиатура с товарами - используем простые callback_data"""
+# Категории, страницы и поисковый индекс строятся один раз при запуске
+catalog = Catalog(config.Products.ITEMS, config.Config.CATALOG_PAGE_SIZE)
+
+@lru_cache(maxsize=None)
+def get_categories_keyboard():
+    """Клавиатура со списком категорий"""
+    keyboard = [
+        [InlineKeyboardButton(text=f"{name} ({len(nums)})", callback_data=f"cat_{index}_0")]
+        for index, (name, nums) in enumerate(catalog.categories)
+    ]
+    return InlineKeyboardMarkup(inline_keyboard=keyboard)
+
+@lru_cache(maxsize=None)
+def get_products_keyboard(category=0, page=0):
+    """Клавиатура со страницей товаров категории - используем простые callback_data"""
     keyboard = []
-    items = list(config.Products.ITEMS.items())
+    items = catalog.page(category, page)
     
     for i in range(0, len(items), 2):
         row = []
-        for j in range(2):
-            if i + j < len(items):
-                item_id, product = items[i + j]
-                # Используем простой номер вместо item_1, item_2
-                button = InlineKeyboardButton(
-                    text=f"{product['name']} - {product['price']}₽",
-                    callback_data=f"prod_{i+j+1}"
-                )
-                row.append(button)
+        for num, item_id, product in items[i:i + 2]:
+            # Используем простой номер вместо item_1, item_2
+            button = InlineKeyboardButton(
+                text=f"{product['name']} - {product['price']}₽",
+                callback_data=f"prod_{num}"
+            )
+            row.append(button)
         keyboard.append(row)
     
+    # Листание страниц
+    pages = catalog.page_count(category)
+    if pages > 1:
+        navigation = []
+        if page > 0:
+            navigation.append(InlineKeyboardButton(text="◀️", callback_data=f"cat_{category}_{page - 1}"))
+        navigation.append(InlineKeyboardButton(text=f"{page + 1}/{pages}", callback_data=f"cat_{category}_{page}"))
+        if page < pages - 1:
+            navigation.append(InlineKeyboardButton(text="▶️", callback_data=f"cat_{category}_{page + 1}"))
+        keyboard.append(navigation)
+    
+    if any(product.get('photo_url') for _, _, product in items):
+        keyboard.append([InlineKeyboardButton(text="📷 Посмотреть фото", callback_data=f"photos_{category}_{page}")])
+    
+    if len(catalog.categories) > 1:
+        keyboard.append([InlineKeyboardButton(text="⬅️ Категории", callback_data="cats")])
+    
     return InlineKeyboardMarkup(inline_keyboard=keyboard)
 
+def get_catalog_view(title, footer, category=None, page=0):
+    """Текст и клавиатура каталога: список категорий или страница категории"""
+    if category is None:
+        if len(catalog.categories) > 1:
+            return f"{title}\n\nВыберите категорию:", get_categories_keyboard()
+        category = 0
+    
+    text = title + "\n\n"
+    if len(catalog.categories) > 1:
+        text += f"<b>{catalog.categories[category][0]}</b>\n\n"
+    for num, item_id, product in catalog.page(category, page):
+        text += f"{num}. {product['name']} - {product['price']}₽\n"
+    text += f"\n{footer}"
+    return text, get_products_keyboard(category, page)
+
+def parse_catalog_callback(data):
+    """Разбирает callback_data вида cat_<категория>_<страница> (и photos_...) в (category, page)"""
+    parts = data.split("_")
+    category = int(parts[1]) if len(parts) > 1 else 0
+    page = int(parts[2]) if len(parts) > 2 else 0
+    if not 0 <= category < len(catalog.categories):
+        category = 0
+    page = min(max(page, 0), catalog.page_count(category) - 1)
+    return category, page
+
 def get_cart_keyboard():
     """Клавиатура корзины"""
     return InlineKeyboardMarkup(inline_keyboard=[
@@ -74,14 +150,36 @@ def get_cart_keyboard():
 # Хранилище корзин пользователей
 user_carts = {}
 
-# Сопоставление номеров с товарами
-PRODUCT_MAPPING = {
-    "1": "item_1",
-    "2": "item_2", 
-    "3": "item_3",
-    "4": "item_4",
-    "5": "item_5"
-}
+# Версия корзины растёт при каждом изменении — из неё строится ключ идемпотентности заказа
+cart_versions = {}
+
+# Блокировки оформления заказа по пользователям: user_id -> [Lock, сколько оформлений ждут или идут]
+user_locks = {}
+
+@asynccontextmanager
+async def user_checkout_lock(user_id):
+    """Сериализует оформление заказов одного пользователя.
+    Блокировка удаляется, когда её никто не держит и не ждёт, — словарь не растёт со временем.
+    """
+    entry = user_locks.setdefault(user_id, [asyncio.Lock(), 0])
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            yield
+    finally:
+        entry[1] -= 1
+        if entry[1] == 0:
+            del user_locks[user_id]
+
+def bump_cart_version(user_id):
+    cart_versions[user_id] = cart_versions.get(user_id, 0) + 1
+
+def parse_order_callback(data):
+    """Разбирает callback_data вида action_<order_id>[_<version>] в (order_id, version)"""
+    parts = data.split("_")
+    order_id = int(parts[1])
+    version = int(parts[2]) if len(parts) > 2 else None
+    return order_id, version
 
 @dp.message(Command("start"))
 async def start_command(message: types.Message):
@@ -95,6 +193,7 @@ async def start_command(message: types.Message):
 • 🛍️ Заказать товары - выбрать товары из каталога
 • 📞 Контакты - связаться с нами
 • ℹ️ О магазине - информация о магазине
+• /orders - история и статус ваших заказов
 
 Выберите действие или используйте кнопки ниже:
     """
@@ -103,14 +202,61 @@ async def start_command(message: types.Message):
 
 @dp.message(F.text == "🛍️ Заказать товары")
 async def show_products(message: types.Message):
-    products_text = "🎂 <b>Наши кондитерские изделия:</b>\n\n"
-    
-    for num, (item_id, product) in enumerate(config.Products.ITEMS.items(), 1):
-        products_text += f"{num}. {product['name']} - {product['price']}₽\n"
-    
-    products_text += "\nВыберите товар для заказа:"
-    
-    await message.answer(products_text, reply_markup=get_products_keyboard(), parse_mode='HTML')
+    products_text, keyboard = get_catalog_view("🎂 <b>Наши кондитерские изделия:</b>", "Выберите товар для заказа:")
+    await message.answer(products_text, reply_markup=keyboard, parse_mode='HTML')
+
+@dp.callback_query(F.data == "cats")
+async def show_categories(callback: types.CallbackQuery):
+    products_text, keyboard = get_catalog_view("🎂 <b>Наши кондитерские изделия:</b>", "Выберите товар для заказа:")
+    await callback.message.edit_text(products_text, reply_markup=keyboard, parse_mode='HTML')
+    await callback.answer()
+
+@dp.callback_query(F.data.startswith("cat_"))
+async def show_category_page(callback: types.CallbackQuery):
+    category, page = parse_catalog_callback(callback.data)
+    products_text, keyboard = get_catalog_view(
+        "🎂 <b>Наши кондитерские изделия:</b>", "Выберите товар для заказа:", category, page
+    )
+    try:
+        await callback.message.edit_text(products_text, reply_markup=keyboard, parse_mode='HTML')
+    except TelegramBadRequest:
+        # Нажата кнопка текущей страницы — сообщение не изменилось
+        pass
+    await callback.answer()
+
+@dp.inline_query()
+async def inline_product_search(inline_query: types.InlineQuery):
+    """Поиск товаров в inline-режиме: @bot эклер"""
+    offset = int(inline_query.offset) if inline_query.offset.isdigit() else 0
+    limit = config.Config.INLINE_RESULTS_LIMIT
+    found = catalog.search(inline_query.query, limit=limit + 1, offset=offset)
+    
+    results = []
+    for num, item_id, product in found[:limit]:
+        description = f"{product['price']}₽"
+        if product.get('category'):
+            description += f" · {product['category']}"
+        results.append(InlineQueryResultArticle(
+            id=item_id,
+            title=product['name'],
+            description=description,
+            thumbnail_url=product.get('photo_url'),
+            input_message_content=InputTextMessageContent(
+                message_text=f"<b>{product['name']}</b> — {product['price']}₽",
+                parse_mode='HTML'
+            ),
+            reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+                [InlineKeyboardButton(text="🛒 В корзину", callback_data=f"prod_{num}")]
+            ])
+        ))
+    
+    # Каталог одинаков для всех пользователей — Telegram может кэшировать ответ
+    await inline_query.answer(
+        results,
+        cache_time=300,
+        is_personal=False,
+        next_offset=str(offset + limit) if len(found) > limit else ""
+    )
 
 @dp.message(F.text == "📞 Контакты")
 async def show_contacts(message: types.Message):
@@ -148,19 +294,19 @@ async def about_shop(message: types.Message):
     """
     await message.answer(about_text, parse_mode='HTML')
 
-@dp.callback_query(F.data.startswith("prod_"))
+@dp.callback_query(F.data.startswith("prod_"), flags={"throttling": "debounce"})
 async def add_to_cart(callback: types.CallbackQuery):
     user_id = callback.from_user.id
     product_num = callback.data.split("_")[1]  # Получаем "1", "2" и т.д.
     
-    print(f"Adding product number: {product_num}")  # Для отладки
+    logger.debug(f"Adding product number: {product_num}")
     
-    if product_num not in PRODUCT_MAPPING:
+    found = catalog.get(product_num)
+    if found is None:
         await callback.answer("❌ Товар не найден!")
         return
     
-    product_key = PRODUCT_MAPPING[product_num]
-    product = config.Products.ITEMS[product_key]
+    product_key, product = found
     
     if user_id not in user_carts:
         user_carts[user_id] = {}
@@ -172,39 +318,90 @@ async def add_to_cart(callback: types.CallbackQuery):
         cart[product_key] += 1
     else:
         cart[product_key] = 1
+    bump_cart_version(user_id)
+    
+    async def render_cart():
+        # Показываем корзину в том виде, в котором она стала после последнего нажатия
+        cart = user_carts.get(user_id)
+        if not cart or callback.message.photo:
+            # Карточку с фото не перерисовываем — корзина доступна по /cart
+            return
+        
+        cart_text = "🛒 <b>Товар добавлен в корзину!</b>\n\n"
+        total = 0
+        
+        for cart_product_key, quantity in cart.items():
+            if cart_product_key in config.Products.ITEMS:
+                product_item = config.Products.ITEMS[cart_product_key]
+                item_total = product_item['price'] * quantity
+                total += item_total
+                cart_text += f"• {product_item['name']} - {quantity}шт. × {product_item['price']}₽ = {item_total}₽\n"
+        
+        cart_text += f"\n<b>Итого: {total}₽</b>"
+        
+        await callback.message.edit_text(
+            cart_text,
+            reply_markup=get_cart_keyboard(),
+            parse_mode='HTML'
+        )
     
-    # Показываем корзину после добавления товара
-    cart_text = "🛒 <b>Товар добавлен в корзину!</b>\n\n"
-    total = 0
-    
-    for cart_product_key, quantity in cart.items():
-        if cart_product_key in config.Products.ITEMS:
-            product_item = config.Products.ITEMS[cart_product_key]
-            item_total = product_item['price'] * quantity
-            total += item_total
-            cart_text += f"• {product_item['name']} - {quantity}шт. × {product_item['price']}₽ = {item_total}₽\n"
+    # Количество подтверждаем сразу, а сообщение перерисуем один раз после серии нажатий
+    await callback.answer(f"✅ {product['name']} добавлен в корзину! ({cart[product_key]} шт.)")
+    if callback.message is None:
+        # Кнопка из inline-результата в чужом чате — корзина доступна по /cart
+        return
+    cart_edits.schedule((callback.message.chat.id, callback.message.message_id), render_cart)
+
+async def send_product_photo(message: types.Message, num, item_id, item):
+    """Карточка товара с фото. Фото загружается в Telegram один раз, дальше отправляется по file_id."""
+    product = db.get_product_by_sku(item_id)
+    caption = f"<b>{item['name']}</b>\n💰 {item['price']}₽"
+    if item.get('description'):
+        caption += f"\n\n{item['description']}"
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="🛒 В корзину", callback_data=f"prod_{num}")]
+    ])
     
-    cart_text += f"\n<b>Итого: {total}₽</b>"
+    if product and product.photo_file_id:
+        try:
+            await message.answer_photo(product.photo_file_id, caption=caption, reply_markup=keyboard, parse_mode='HTML')
+            return
+        except TelegramBadRequest as e:
+            # file_id больше не действителен (например, сменился токен бота) — загрузим заново
+            logger.warning(f"Cached photo for {item_id} rejected: {e}")
+    
+    sent = await message.answer_photo(item['photo_url'], caption=caption, reply_markup=keyboard, parse_mode='HTML')
+    if product and sent.photo:
+        # Самый крупный размер — последний
+        db.set_product_photo_file_id(product.id, sent.photo[-1].file_id)
+
+@dp.callback_query(F.data.startswith("photos"))
+async def show_product_photos(callback: types.CallbackQuery):
+    """Фотографии товаров текущей страницы каталога"""
+    category, page = parse_catalog_callback(callback.data)
+    items = [
+        (num, item_id, item)
+        for num, item_id, item in catalog.page(category, page)
+        if item.get('photo_url')
+    ]
+    if not items:
+        await callback.answer("📷 Фотографии товаров пока не добавлены")
+        return
     
-    await callback.message.edit_text(
-        cart_text,
-        reply_markup=get_cart_keyboard(),
-        parse_mode='HTML'
-    )
-    await callback.answer(f"✅ {product['name']} добавлен в корзину!")
+    await callback.answer()
+    for num, item_id, item in items:
+        try:
+            await send_product_photo(callback.message, num, item_id, item)
+        except Exception as e:
+            logger.error(f"Photo send error for {item_id}: {e}")
 
 @dp.callback_query(F.data == "add_more")
 async def add_more_products(callback: types.CallbackQuery):
-    products_text = "🎂 <b>Выберите товары:</b>\n\n"
-    
-    for num, (item_id, product) in enumerate(config.Products.ITEMS.items(), 1):
-        products_text += f"{num}. {product['name']} - {product['price']}₽\n"
-    
-    products_text += "\nВыберите товар для добавления:"
+    products_text, keyboard = get_catalog_view("🎂 <b>Выберите товары:</b>", "Выберите товар для добавления:")
     
     await callback.message.edit_text(
         products_text,
-        reply_markup=get_products_keyboard(),
+        reply_markup=keyboard,
         parse_mode='HTML'
     )
     await callback.answer()
@@ -214,26 +411,36 @@ async def clear_cart(callback: types.CallbackQuery):
     user_id = callback.from_user.id
     if user_id in user_carts:
         user_carts[user_id] = {}
+    bump_cart_version(user_id)
     
-    products_text = "🗑️ <b>Корзина очищена!</b>\n\n🎂 <b>Наши кондитерские изделия:</b>\n\n"
-    
-    for num, (item_id, product) in enumerate(config.Products.ITEMS.items(), 1):
-        products_text += f"{num}. {product['name']} - {product['price']}₽\n"
-    
-    products_text += "\nВыберите товары для нового заказа:"
+    products_text, keyboard = get_catalog_view(
+        "🗑️ <b>Корзина очищена!</b>\n\n🎂 <b>Наши кондитерские изделия:</b>", "Выберите товары для нового заказа:"
+    )
     
     await callback.message.edit_text(
         products_text,
-        reply_markup=get_products_keyboard(),
+        reply_markup=keyboard,
         parse_mode='HTML'
     )
     await callback.answer()
 
 @dp.callback_query(F.data == "checkout")
-async def process_checkout(callback: types.CallbackQuery):
+async def process_checkout(callback: types.CallbackQuery, outbox_sender: OutboxSender = None):
+    # Двойное нажатие «Оформить заказ» не должно оформлять корзину дважды
+    async with user_checkout_lock(callback.from_user.id):
+        await checkout_cart(callback, outbox_sender)
+
+async def checkout_cart(callback: types.CallbackQuery, outbox_sender=None):
     user_id = callback.from_user.id
     cart = user_carts.get(user_id, {})
     
+    # Ключ одинаков для повторных нажатий на одном сообщении с одной и той же корзиной
+    idempotency_key = f"{user_id}:{callback.message.message_id}:{cart_versions.get(user_id, 0)}"
+    existing_order = db.get_order_by_idempotency_key(idempotency_key)
+    if existing_order:
+        await callback.answer(f"✅ Заказ #{existing_order.id} уже оформлен")
+        return
+    
     if not cart:
         await callback.answer("🛒 Корзина пуста!")
         return
@@ -258,23 +465,19 @@ async def process_checkout(callback: types.CallbackQuery):
         await callback.answer("❌ Ошибка: товары не найдены!")
         return
     
-    # Создаем заказ в базе данных
-    order_id = db.add_order(
-        user_id=callback.from_user.id,
-        username=callback.from_user.username,
-        first_name=callback.from_user.first_name,
-        items=items_list,
-        total_amount=total
-    )
-    
     # Определяем время оформления заказа в Ташкенте для отображения
     if TZ is not None:
         now_display = datetime.now(TZ).strftime('%Y-%m-%d %H:%M:%S')
     else:
         now_display = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    
+    # Функция ниже может выполниться в потоке group commit, где контекста апдейта уже нет
+    trace_id = tracing.get_trace_id()
 
-    # Формируем текст заказа для канала
-    order_text = f"""
+    def build_channel_message(order_id):
+        """Сообщение о заказе для канала — кладётся в outbox вместе с заказом"""
+        # Формируем текст заказа для канала
+        order_text = f"""
 🛒 <b>НОВЫЙ ЗАКАЗ #{order_id}</b>
 
 👤 <b>Клиент:</b> {callback.from_user.first_name} (@{callback.from_user.username})
@@ -282,48 +485,46 @@ async def process_checkout(callback: types.CallbackQuery):
 
 <b>Товары:</b>
 """
-    for item in items_list:
-        order_text += f"• {item['name']} - {item['quantity']}шт. × {item['price']}₽ = {item['total']}₽\n"
-    
-    order_text += f"""
+        for item in items_list:
+            order_text += f"• {item['name']} - {item['quantity']}шт. × {item['price']}₽ = {item['total']}₽\n"
+        
+        order_text += f"""
 <b>💰 Итого: {total}₽</b>
 ⏰ <b>Время:</b> {now_display}
 
 💡 <i>Для связи с клиентом: @{callback.from_user.username}</i>
     """
-    
-    # Клавиатура для админов
-    admin_keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="🖨️ Распечатать чек", callback_data=f"print_{order_id}")],
-        [InlineKeyboardButton(text="✅ Подтвержден", callback_data=f"confirm_{order_id}"),
-         InlineKeyboardButton(text="❌ Отменить", callback_data=f"cancel_{order_id}")]
-    ])
-    
-    try:
-        # Отправляем заказ в канал
-        await bot.send_message(
-            chat_id=config.Config.CHANNEL_ID,
-            text=order_text,
-            reply_markup=admin_keyboard,
-            parse_mode='HTML'
-        )
         
-        # Очищаем корзину пользователя
-        if user_id in user_carts:
-            del user_carts[user_id]
-        
-        # Сообщение пользователю
-        await callback.message.edit_text(
-            f"✅ <b>Ваш заказ #{order_id} принят!</b>\n\n"
-            f"<b>Сумма:</b> {total}₽\n"
-            f"<b>Статус:</b> Ожидает подтверждения\n\n"
-            f"Мы свяжемся с вами в ближайшее время для уточнения деталей доставки.\n\n"
-            f"📞 {config.Config.SHOP_PHONE}",
-            parse_mode='HTML'
-        )
-        
-        logger.info(f"New order #{order_id} from user {callback.from_user.id}")
+        # Клавиатура для админов
+        admin_keyboard = InlineKeyboardMarkup(inline_keyboard=[
+            # Версия заказа в кнопках: нажатие на устаревшее сообщение не перезапишет чужое решение
+            [InlineKeyboardButton(text="🖨️ Распечатать чек", callback_data=f"print_{order_id}_0")],
+            [InlineKeyboardButton(text="✅ Подтвержден", callback_data=f"confirm_{order_id}_0"),
+             InlineKeyboardButton(text="❌ Отменить", callback_data=f"cancel_{order_id}_0")]
+        ])
         
+        return {
+            'chat_id': str(config.Config.CHANNEL_ID),
+            'text': order_text,
+            'reply_markup': admin_keyboard.model_dump_json(exclude_none=True),
+            'parse_mode': 'HTML',
+            'trace_id': trace_id
+        }
+    
+    try:
+        # Создаем заказ и сообщение для канала в одной транзакции
+        # (с DB_GROUP_COMMIT — общей с заказами других покупателей)
+        with tracing.span('db.add_order') as span:
+            order_id = await asyncio.wrap_future(db.submit_order(
+                user_id=callback.from_user.id,
+                username=callback.from_user.username,
+                first_name=callback.from_user.first_name,
+                items=items_list,
+                total_amount=total,
+                notification=build_channel_message,
+                idempotency_key=idempotency_key
+            ))
+            span.attrs['order_id'] = order_id
     except Exception as e:
         await callback.message.edit_text(
             "❌ <b>Ошибка при оформлении заказа</b>\n\n"
@@ -331,6 +532,30 @@ async def process_checkout(callback: types.CallbackQuery):
             parse_mode='HTML'
         )
         logger.error(f"Order error: {e}")
+        await callback.answer()
+        return
+    
+    # Сообщение в канал отправит фоновый отправитель
+    if outbox_sender is not None:
+        outbox_sender.notify()
+    
+    # Очищаем корзину пользователя. Версию тоже забываем: у оформленного сообщения
+    # больше нет кнопки «Оформить заказ», поэтому ключ идемпотентности не повторится
+    if user_id in user_carts:
+        del user_carts[user_id]
+    cart_versions.pop(user_id, None)
+    
+    # Сообщение пользователю
+    await callback.message.edit_text(
+        f"✅ <b>Ваш заказ #{order_id} принят!</b>\n\n"
+        f"<b>Сумма:</b> {total}₽\n"
+        f"<b>Статус:</b> Ожидает подтверждения\n\n"
+        f"Мы свяжемся с вами в ближайшее время для уточнения деталей доставки.\n\n"
+        f"📞 {config.Config.SHOP_PHONE}",
+        parse_mode='HTML'
+    )
+    
+    logger.info(f"New order #{order_id} from user {callback.from_user.id}")
     
     await callback.answer()
 
@@ -341,13 +566,20 @@ async def process_print_order(callback: types.CallbackQuery):
         await callback.answer("❌ У вас нет прав для этого действия!", show_alert=True)
         return
     
-    order_id = int(callback.data.split("_")[1])
-    order = db.get_order(order_id)
+    # Версию из кнопки не сверяем: подтверждение в веб-панели меняет версию, но не кнопки в канале,
+    # а печатать подтверждённый заказ можно. Достаточно проверки статуса.
+    order_id, _ = parse_order_callback(callback.data)
+    with tracing.span('db.get_order', order_id=order_id):
+        order = db.get_order(order_id)
     
     if not order:
         await callback.answer("❌ Заказ не найден!", show_alert=True)
         return
     
+    if not can_print(order):
+        await callback.answer("ℹ️ Статус заказа уже изменён, печать не требуется", show_alert=True)
+        return
+    
     # Формируем данные для чека
     receipt_data = {
         "order_id": order.id,
@@ -364,37 +596,71 @@ async def process_print_order(callback: types.CallbackQuery):
         "shop_phone": config.Config.SHOP_PHONE
     }
     
+    # Смену статуса, пока идёт печать, заметит условный UPDATE по этой версии
+    version = order.version or 0
     try:
-        # Отправляем на печать
-        headers = {"X-API-Key": config.Config.API_SECRET_KEY}
-        response = requests.post(
-            f"{config.Config.PRINTER_API_URL}/print",
-            json=receipt_data,
-            headers=headers,
-            timeout=10
-        )
-        
-        if response.status_code == 200:
-            # Обновляем статус заказа
-            db.update_order_status(order_id, "printed", printed_by=callback.from_user.id)
-            
-            # Обновляем сообщение в канале
-            edited_text = callback.message.text + f"\n\n✅ Чек распечатан администратором"
-            await callback.message.edit_text(
-                edited_text,
-                reply_markup=None,
-                parse_mode='HTML'
-            )
-            await callback.answer("✅ Чек отправлен на печать!")
-            
-            logger.info(f"Receipt printed for order #{order_id}")
+        text, printed = await print_and_mark_printed(order_id, version, receipt_data, callback.message, callback.from_user.id)
+    except PrinterUnavailable:
+        # Выключатель разомкнут: отвечаем сразу, не дожидаясь таймаута
+        if printer_client.park_requests:
+            printer_client.park(order_id, parked_print_job(order_id, receipt_data, callback.message, callback.from_user.id))
+            await callback.answer("🖨️ Принтер офлайн. Чек напечатается автоматически, когда принтер снова будет доступен",
+                                  show_alert=True)
         else:
-            await callback.answer("❌ Ошибка печати чека!", show_alert=True)
-            logger.error(f"Print error for order #{order_id}: {response.text}")
-            
+            await callback.answer("🖨️ Принтер офлайн, попробуйте позже", show_alert=True)
+        return
     except Exception as e:
         await callback.answer(f"❌ Ошибка: {str(e)}", show_alert=True)
         logger.error(f"Print exception for order #{order_id}: {str(e)}")
+        return
+    
+    await callback.answer(text, show_alert=not printed)
+
+def can_print(order):
+    """Заказ ещё можно печатать: он не напечатан и не отменён"""
+    return order.status in ORDER_STATUS_TRANSITIONS['printed']
+
+async def print_and_mark_printed(order_id, version, receipt_data, message, admin_id):
+    """Печатает чек, отмечает заказ напечатанным и обновляет сообщение в канале.
+    Возвращает (текст ответа администратору, чек напечатан).
+    """
+    response = await printer_client.print_receipt(receipt_data)
+    if response.status_code != 200:
+        logger.error(f"Print error for order #{order_id}: {response.text}")
+        return "❌ Ошибка печати чека!", False
+    
+    # Обновляем статус заказа
+    with tracing.span('db.update_status', order_id=order_id):
+        updated = await asyncio.wrap_future(db.submit_status_update(
+            order_id, "printed", printed_by=admin_id, expected_version=version))
+    if not updated:
+        # Пока шла печать, заказ изменили — сообщение в канале уже обновлено другим действием
+        logger.info(f"Receipt printed for order #{order_id}, status changed concurrently")
+        return "✅ Чек отправлен на печать, но статус заказа уже изменён", True
+    
+    # Обновляем сообщение в канале
+    edited_text = message.text + f"\n\n✅ Чек распечатан администратором"
+    with tracing.span('telegram.edit_message', order_id=order_id):
+        await message.edit_text(
+            edited_text,
+            reply_markup=None,
+            parse_mode='HTML'
+        )
+    
+    logger.info(f"Receipt printed for order #{order_id}")
+    return "✅ Чек отправлен на печать!", True
+
+def parked_print_job(order_id, receipt_data, message, admin_id):
+    """Отложенная печать: выполняется, когда принтер снова доступен"""
+    async def job():
+        order = db.get_order(order_id)
+        if not order or not can_print(order):
+            logger.info(f"Parked print of order #{order_id} skipped: order already printed or cancelled")
+            return
+        text, printed = await print_and_mark_printed(order_id, order.version or 0, receipt_data, message, admin_id)
+        if not printed:
+            raise RuntimeError(text)
+    return job
 
 @dp.callback_query(F.data.startswith("confirm_"))
 async def confirm_order_admin(callback: types.CallbackQuery):
@@ -403,8 +669,10 @@ async def confirm_order_admin(callback: types.CallbackQuery):
         await callback.answer("❌ У вас нет прав!", show_alert=True)
         return
     
-    order_id = int(callback.data.split("_")[1])
-    db.update_order_status(order_id, "confirmed")
+    order_id, version = parse_order_callback(callback.data)
+    if not await asyncio.wrap_future(db.submit_status_update(order_id, "confirmed", expected_version=version)):
+        await callback.answer("ℹ️ Статус заказа уже изменён", show_alert=True)
+        return
     
     edited_text = callback.message.text + f"\n\n✅ Подтвержден администратором"
     await callback.message.edit_text(edited_text, parse_mode='HTML')
@@ -417,8 +685,10 @@ async def cancel_order_admin(callback: types.CallbackQuery):
         await callback.answer("❌ У вас нет прав!", show_alert=True)
         return
     
-    order_id = int(callback.data.split("_")[1])
-    db.update_order_status(order_id, "cancelled")
+    order_id, version = parse_order_callback(callback.data)
+    if not await asyncio.wrap_future(db.submit_status_update(order_id, "cancelled", expected_version=version)):
+        await callback.answer("ℹ️ Статус заказа уже изменён", show_alert=True)
+        return
     
     edited_text = callback.message.text + f"\n\n❌ Отменен администратором"
     await callback.message.edit_text(edited_text, parse_mode='HTML')
@@ -463,6 +733,37 @@ async def show_cart_command(message: types.Message):
     
     await message.answer(cart_text, reply_markup=get_cart_keyboard(), parse_mode='HTML')
 
+ORDER_STATUS_NAMES = {
+    'new': '🕐 Ожидает подтверждения',
+    'confirmed': '✅ Подтвержден',
+    'printed': '🧾 Готовится',
+    'cancelled': '❌ Отменен'
+}
+
+def format_local_time(dt):
+    """UTC-время из БД в строку по Ташкенту"""
+    if dt is None:
+        return ''
+    if TZ is not None:
+        dt = dt.replace(tzinfo=ZoneInfo('UTC')).astimezone(TZ)
+    return dt.strftime('%Y-%m-%d %H:%M')
+
+@dp.message(Command("orders"))
+async def show_orders_command(message: types.Message):
+    """История заказов покупателя"""
+    orders = db.get_user_orders(message.from_user.id, limit=10)
+    
+    if not orders:
+        await message.answer("📦 У вас пока нет заказов. Используйте кнопку '🛍️ Заказать товары'")
+        return
+    
+    orders_text = "📦 <b>Ваши последние заказы:</b>\n\n"
+    for order in orders:
+        status = ORDER_STATUS_NAMES.get(order['status'], order['status'])
+        orders_text += f"<b>#{order['id']}</b> от {format_local_time(order['created_at'])} — {order['total_amount']:g}₽\n{status}\n\n"
+    
+    await message.answer(orders_text, parse_mode='HTML')
+
 @dp.message(Command("debug"))
 async def debug_command(message: types.Message):
     """Команда для отладки"""
@@ -484,11 +785,47 @@ async def debug_command(message: types.Message):
     await message.answer(debug_text, parse_mode='HTML')
 
 async def main():
+    setup_logging('bot')
     logger.info("Бот запускается...")
+    tracing.configure('bot')
+    try:
+        bot = create_bot()
+    except Exception as e:
+        logger.error(f"Ошибка создания бота: {e}")
+        raise SystemExit(1)
+    
+    # Товары из config попадают в БД — там хранятся file_id загруженных фото
+    db.sync_products(config.Products.ITEMS)
+    
+    # Фоновая отправка заказов в канал с учётом лимитов Telegram
+    outbox_sender = OutboxSender(bot, db)
+    dp["outbox_sender"] = outbox_sender
+    
+    # Апдейты одного пользователя — по порядку, разных пользователей — параллельно
+    update_queue = ShardedUpdateMiddleware()
+    dp.update.outer_middleware(update_queue)
+    
+    background_tasks = [
+        asyncio.create_task(outbox_sender.run()),
+        asyncio.create_task(printer_client.run_health_probe())
+    ]
+    if config.Config.ARCHIVE_AFTER_DAYS > 0:
+        if config.Config.ARCHIVE_DATABASE_URL:
+            from archive import run_archiver
+            background_tasks.append(asyncio.create_task(run_archiver(db)))
+        else:
+            logger.warning("ARCHIVE_AFTER_DAYS is set but ARCHIVE_DATABASE_URL is not: archiving is disabled")
     try:
-        await dp.start_polling(bot)
+        # handle_as_tasks=False: polling ждёт места в очереди, а не плодит задачи без ограничений
+        await dp.start_polling(bot, handle_as_tasks=False)
     except Exception as e:
         logger.error(f"Ошибка при запуске бота: {e}")
+    finally:
+        for task in background_tasks:
+            task.cancel()
+        await update_queue.close()
+        if db.writer is not None:
+            db.writer.close()
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
@@ -0,0 +1,112 @@
+"""Каталог товаров: категории, страницы и поиск по названию.
+
+Индексы строятся один раз из config.Products.ITEMS, поэтому страница категории
+и поиск не перебирают весь каталог. Номер товара (prod_N в кнопках) — его позиция
+в ITEMS, как и раньше.
+"""
+import re
+from collections import Counter, defaultdict
+
+DEFAULT_CATEGORY = 'Другое'
+
+_WORD_RE = re.compile(r'\w+')
+
+
+def normalize(text):
+    return text.lower().replace('ё', 'е')
+
+
+def words(text):
+    return _WORD_RE.findall(normalize(text))
+
+
+def trigrams(word):
+    padded = f'  {word} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class Catalog:
+    def __init__(self, items, page_size=8):
+        self.page_size = max(1, page_size)
+        # Номер товара (строкой, как в callback_data) -> (ключ, товар)
+        self.by_num = {}
+        # [(название категории, [номера товаров])] в порядке первого появления
+        self.categories = []
+        category_index = {}
+        for num, (key, item) in enumerate(items.items(), 1):
+            self.by_num[str(num)] = (key, item)
+            name = item.get('category') or DEFAULT_CATEGORY
+            if name not in category_index:
+                category_index[name] = len(self.categories)
+                self.categories.append((name, []))
+            self.categories[category_index[name]][1].append(num)
+
+        # Поисковый индекс: префикс слова -> номера товаров; триграмма -> слова (для опечаток)
+        self._prefixes = defaultdict(set)
+        self._word_nums = defaultdict(set)
+        self._trigrams = defaultdict(set)
+        self._trigram_counts = {}
+        for num_str, (key, item) in self.by_num.items():
+            num = int(num_str)
+            for word in words(item['name']):
+                self._word_nums[word].add(num)
+                for end in range(1, len(word) + 1):
+                    self._prefixes[word[:end]].add(num)
+        for word in self._word_nums:
+            grams = trigrams(word)
+            self._trigram_counts[word] = len(grams)
+            for gram in grams:
+                self._trigrams[gram].add(word)
+
+    def get(self, num):
+        """(ключ, товар) по номеру из callback_data или None"""
+        return self.by_num.get(str(num))
+
+    def page_count(self, category):
+        nums = self.categories[category][1]
+        return max(1, -(-len(nums) // self.page_size))
+
+    def page(self, category, page):
+        """[(номер, ключ, товар)] на странице page категории category"""
+        nums = self.categories[category][1]
+        start = page * self.page_size
+        return [(num,) + self.by_num[str(num)] for num in nums[start:start + self.page_size]]
+
+    def _match_word(self, token):
+        """{номер товара: вес} для одного слова запроса"""
+        nums = self._prefixes.get(token)
+        if nums:
+            return dict.fromkeys(nums, 1.0)
+        # Нет слова с таким началом — ищем похожие слова по общим триграммам (опечатки)
+        grams = trigrams(token)
+        common = Counter()
+        for gram in grams:
+            for word in self._trigrams.get(gram, ()):
+                common[word] += 1
+        matches = {}
+        for word, shared in common.items():
+            similarity = shared / (len(grams) + self._trigram_counts[word] - shared)
+            if similarity >= 0.3:
+                for num in self._word_nums[word]:
+                    matches[num] = max(matches.get(num, 0.0), similarity)
+        return matches
+
+    def search(self, query, limit=20, offset=0):
+        """Товары, в названии которых есть все слова запроса (по началу слова или с опечаткой).
+        Возвращает [(номер, ключ, товар)], лучшие совпадения первыми.
+        """
+        tokens = words(query)
+        if not tokens:
+            nums = list(range(1, len(self.by_num) + 1))
+        else:
+            scores = None
+            for token in tokens:
+                matches = self._match_word(token)
+                if scores is None:
+                    scores = matches
+                else:
+                    scores = {num: score + matches[num] for num, score in scores.items() if num in matches}
+                if not scores:
+                    return []
+            nums = sorted(scores, key=lambda num: (-scores[num], num))
+        return [(num,) + self.by_num[str(num)] for num in nums[offset:offset + limit]]
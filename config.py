@@ -12,10 +12,71 @@ class Config:
     # Database
     DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///orders.db")
     
+    # SQLite: журнал WAL (читатели не блокируют писателя), сколько ждать занятую базу
+    # вместо ошибки "database is locked" и режим fsync (FULL, NORMAL или OFF)
+    SQLITE_WAL = os.getenv("SQLITE_WAL", "true").lower() == "true"
+    SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+    SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "FULL").upper()
+    
+    # Group commit: новые заказы и смены статуса копятся до DB_GROUP_COMMIT_INTERVAL_MS
+    # и фиксируются одной транзакцией (не больше DB_GROUP_COMMIT_MAX_BATCH за раз)
+    DB_GROUP_COMMIT = os.getenv("DB_GROUP_COMMIT", "false").lower() == "true"
+    DB_GROUP_COMMIT_INTERVAL_MS = float(os.getenv("DB_GROUP_COMMIT_INTERVAL_MS", "2"))
+    DB_GROUP_COMMIT_MAX_BATCH = int(os.getenv("DB_GROUP_COMMIT_MAX_BATCH", "100"))
+    
+    # Сколько секунд хранить в памяти историю заказов покупателя для /orders
+    USER_ORDERS_CACHE_TTL = float(os.getenv("USER_ORDERS_CACHE_TTL", "60"))
+    
     # Printer
     PRINTER_API_URL = os.getenv("PRINTER_API_URL", "http://localhost:5000")
     PRINTER_HOST = os.getenv("PRINTER_HOST", "localhost")
     PRINTER_PORT = int(os.getenv("PRINTER_PORT", "9100"))
+    # Запрос к серверу печати: таймаут; после PRINTER_BREAKER_FAILURES ошибок подряд бот считает
+    # принтер офлайн и проверяет /health каждые PRINTER_HEALTH_INTERVAL секунд (пробный запрос печати —
+    # не раньше чем через PRINTER_BREAKER_RESET_SECONDS). PRINTER_PARK_REQUESTS — печатать
+    # отложенные чеки автоматически, когда принтер вернётся
+    PRINTER_TIMEOUT = float(os.getenv("PRINTER_TIMEOUT", "10"))
+    PRINTER_BREAKER_FAILURES = int(os.getenv("PRINTER_BREAKER_FAILURES", "3"))
+    PRINTER_BREAKER_RESET_SECONDS = float(os.getenv("PRINTER_BREAKER_RESET_SECONDS", "30"))
+    PRINTER_HEALTH_INTERVAL = float(os.getenv("PRINTER_HEALTH_INTERVAL", "5"))
+    PRINTER_PARK_REQUESTS = os.getenv("PRINTER_PARK_REQUESTS", "false").lower() == "true"
+    
+    # Обработка апдейтов: сколько пользователей обслуживается параллельно и длина очереди
+    # каждого воркера (при заполнении бот перестаёт забирать новые апдейты у Telegram)
+    UPDATE_WORKERS = int(os.getenv("UPDATE_WORKERS", "8"))
+    UPDATE_QUEUE_SIZE = int(os.getenv("UPDATE_QUEUE_SIZE", "100"))
+    
+    # Очередь сообщений в канал заказов (лимит Telegram — около 20 сообщений в минуту на чат)
+    OUTBOX_RATE_PER_MINUTE = float(os.getenv("OUTBOX_RATE_PER_MINUTE", "20"))
+    OUTBOX_BURST = int(os.getenv("OUTBOX_BURST", "5"))
+    
+    # Защита от частых нажатий: повтор той же кнопки чаще этого интервала отбрасывается,
+    # а перерисовка корзины откладывается, пока пользователь продолжает добавлять товары
+    CALLBACK_THROTTLE_SECONDS = float(os.getenv("CALLBACK_THROTTLE_SECONDS", "0.5"))
+    CART_EDIT_DEBOUNCE_SECONDS = float(os.getenv("CART_EDIT_DEBOUNCE_SECONDS", "0.7"))
+    
+    # Каталог: сколько товаров на одной странице категории и в одном ответе inline-поиска
+    CATALOG_PAGE_SIZE = int(os.getenv("CATALOG_PAGE_SIZE", "8"))
+    INLINE_RESULTS_LIMIT = int(os.getenv("INLINE_RESULTS_LIMIT", "20"))
+    
+    # Архив: заказы старше ARCHIVE_AFTER_DAYS переносятся в отдельную базу ARCHIVE_DATABASE_URL
+    # (0 — не архивировать; без ARCHIVE_DATABASE_URL архивация не запускается)
+    ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "0"))
+    ARCHIVE_DATABASE_URL = os.getenv("ARCHIVE_DATABASE_URL", "")
+    ARCHIVE_INTERVAL_HOURS = float(os.getenv("ARCHIVE_INTERVAL_HOURS", "24"))
+    
+    # Логирование: уровень, файл (JSON lines, пусто — только консоль), формат консоли (text или json),
+    # ротация по размеру или по времени (LOG_ROTATE_WHEN, например "midnight"), длина очереди записей
+    LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+    LOG_FILE = os.getenv("LOG_FILE", "")
+    LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()
+    LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+    LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "5"))
+    LOG_ROTATE_WHEN = os.getenv("LOG_ROTATE_WHEN", "")
+    LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+    
+    # Трассировка: файл, куда пишутся спаны (JSON lines); пусто — трассировка выключена
+    TRACE_LOG_FILE = os.getenv("TRACE_LOG_FILE", "")
     
     # Security
     API_SECRET_KEY = os.getenv("API_SECRET_KEY", "your-secret-key-change-this-in-production")
@@ -1,11 +1,28 @@
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Float, Text, Boolean
+from sqlalchemy import create_engine, event, func, inspect, literal, literal_column, text, Column, Index, Integer, String, DateTime, Float, Text, Boolean
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+import logging
+import threading
+import time
+from concurrent.futures import Future
 from datetime import datetime
 import config
+from metrics import instrument_engine
+from order_writer import OrderWriter
+
+logger = logging.getLogger(__name__)
 
 Base = declarative_base()
 
+# Из каких статусов можно перейти в данный статус
+ORDER_STATUS_TRANSITIONS = {
+    'new': ('confirmed', 'cancelled'),
+    'confirmed': ('new',),
+    'printed': ('new', 'confirmed'),
+    'cancelled': ('new', 'confirmed', 'printed'),
+}
+
 class Order(Base):
     __tablename__ = 'orders'
     
@@ -18,9 +35,46 @@ class Order(Base):
     items = Column(Text, nullable=False)
     total_amount = Column(Float, nullable=False)
     status = Column(String(20), default='new')
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+    printed_at = Column(DateTime)
+    printed_by = Column(Integer)
+    # Ключ идемпотентности: повторное оформление той же корзины не создаёт новый заказ
+    idempotency_key = Column(String(100), unique=True, index=True)
+    # Версия для оптимистичной блокировки: растёт при каждой смене статуса
+    version = Column(Integer, default=0, server_default=text('0'))
+    
+    __table_args__ = (
+        # История заказов покупателя: WHERE user_id = ? ORDER BY created_at DESC
+        Index('ix_orders_user_id_created_at', 'user_id', 'created_at'),
+        # id не выдаются повторно, даже если все заказы ушли в архив: старые кнопки print_N
+        # в канале и id в архиве не должны указывать на новый заказ
+        {'sqlite_autoincrement': True},
+    )
+
+# Архив живёт в отдельной базе (ARCHIVE_DATABASE_URL), поэтому у него свои метаданные
+ArchiveBase = declarative_base()
+
+class OrderArchive(ArchiveBase):
+    """Заказы старше ARCHIVE_AFTER_DAYS, перенесённые из orders (см. archive.py).
+    Колонки те же, что у Order, id сохраняется.
+    """
+    __tablename__ = 'orders_archive'
+    
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    user_id = Column(Integer, nullable=False)
+    username = Column(String(100))
+    first_name = Column(String(100))
+    phone = Column(String(20))
+    address = Column(Text)
+    items = Column(Text, nullable=False)
+    total_amount = Column(Float, nullable=False)
+    status = Column(String(20))
+    created_at = Column(DateTime, index=True)
     printed_at = Column(DateTime)
     printed_by = Column(Integer)
+    idempotency_key = Column(String(100))
+    version = Column(Integer, default=0, server_default=text('0'))
+    archived_at = Column(DateTime)
 
 class Product(Base):
     __tablename__ = 'products'
@@ -34,52 +88,413 @@ class Product(Base):
     is_available = Column(Boolean, default=True)
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Ключ товара из config.Products.ITEMS
+    sku = Column(String(50), unique=True, index=True)
+    # file_id фото, уже загруженного в Telegram: повторные отправки не скачивают картинку заново
+    photo_file_id = Column(String(200))
+
+@event.listens_for(Product.photo_url, 'set', active_history=True)
+def _reset_photo_file_id(product, value, old_value, initiator):
+    """Новая ссылка на фото — старый file_id больше не подходит"""
+    if value != old_value:
+        product.photo_file_id = None
+
+class OutboxMessage(Base):
+    """Исходящее сообщение в Telegram, ожидающее отправки фоновым отправителем"""
+    __tablename__ = 'outbox'
+    
+    id = Column(Integer, primary_key=True)
+    order_id = Column(Integer)
+    chat_id = Column(String(100), nullable=False)
+    text = Column(Text, nullable=False)
+    reply_markup = Column(Text)
+    parse_mode = Column(String(20))
+    # Trace id апдейта, оформившего заказ: отправка в канал попадает в ту же трассу
+    trace_id = Column(String(32))
+    attempts = Column(Integer, default=0)
+    last_error = Column(Text)
+    next_attempt_at = Column(DateTime, default=datetime.utcnow, index=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    sent_at = Column(DateTime, index=True)
+
+# Поиск по заказам в SQLite: FTS5-таблица поверх orders, синхронизируется триггерами
+SQLITE_SEARCH_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS orders_fts USING fts5(
+        first_name, username, phone, address,
+        content='orders', content_rowid='id', tokenize='unicode61'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS orders_fts_insert AFTER INSERT ON orders BEGIN
+        INSERT INTO orders_fts(rowid, first_name, username, phone, address)
+        VALUES (new.id, new.first_name, new.username, new.phone, new.address);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS orders_fts_delete AFTER DELETE ON orders BEGIN
+        INSERT INTO orders_fts(orders_fts, rowid, first_name, username, phone, address)
+        VALUES ('delete', old.id, old.first_name, old.username, old.phone, old.address);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS orders_fts_update
+    AFTER UPDATE OF first_name, username, phone, address ON orders BEGIN
+        INSERT INTO orders_fts(orders_fts, rowid, first_name, username, phone, address)
+        VALUES ('delete', old.id, old.first_name, old.username, old.phone, old.address);
+        INSERT INTO orders_fts(rowid, first_name, username, phone, address)
+        VALUES (new.id, new.first_name, new.username, new.phone, new.address);
+    END""",
+]
+
+# Поиск в PostgreSQL: триграммный GIN-индекс по этому выражению
+POSTGRES_SEARCH_EXPRESSION = (
+    "coalesce(first_name, '') || ' ' || coalesce(username, '') || ' ' || "
+    "coalesce(phone, '') || ' ' || coalesce(address, '')"
+)
+
+class UserOrdersCache:
+    """Кэш последних заказов покупателя. Сбрасывается при новом заказе и смене статуса."""
+    
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = {}
+        # order_id -> user_id для заказов, которые лежат в кэше
+        self._owners = {}
+        self._next_prune = 0.0
+    
+    def get(self, user_id, limit):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry and entry[0] > time.monotonic() and entry[1] >= limit:
+                return entry[2][:limit]
+        return None
+    
+    def put(self, user_id, limit, orders):
+        with self._lock:
+            now = time.monotonic()
+            self._drop(user_id)
+            # Истёкшие записи убираем не чаще раза в ttl — кэш не растёт с каждым, кто когда-то вызвал /orders
+            if now >= self._next_prune:
+                for expired in [key for key, entry in self._entries.items() if entry[0] <= now]:
+                    self._drop(expired)
+                self._next_prune = now + self.ttl
+            self._entries[user_id] = (now + self.ttl, limit, orders)
+            for order in orders:
+                self._owners[order['id']] = user_id
+    
+    def invalidate_user(self, user_id):
+        with self._lock:
+            self._drop(user_id)
+    
+    def _drop(self, user_id):
+        """Удаляет запись пользователя вместе с её order_id (вызывается под self._lock)"""
+        entry = self._entries.pop(user_id, None)
+        if entry:
+            for order in entry[2]:
+                if self._owners.get(order['id']) == user_id:
+                    del self._owners[order['id']]
+    
+    def invalidate_order(self, order_id):
+        with self._lock:
+            user_id = self._owners.get(order_id)
+        if user_id is not None:
+            self.invalidate_user(user_id)
 
 class Database:
     def __init__(self, db_url=None):
         self.engine = create_engine(db_url or config.Config.DATABASE_URL)
+        if self.engine.dialect.name == 'sqlite':
+            self._configure_sqlite()
+        instrument_engine(self.engine)
         Base.metadata.create_all(self.engine)
+        self._add_missing_columns()
+        if self.engine.dialect.name == 'sqlite':
+            self._ensure_orders_autoincrement()
+        self.search_backend = self._setup_search()
         Session = sessionmaker(bind=self.engine)
         self.session = Session()
         # Экспортируем модели как атрибуты для удобства вызова в других местах
         self.Order = Order
+        self.OrderArchive = OrderArchive
         self.Product = Product
+        self.OutboxMessage = OutboxMessage
+        self.user_orders_cache = UserOrdersCache(config.Config.USER_ORDERS_CACHE_TTL)
+        # Пакетная запись заказов (group commit), если включена
+        self.writer = OrderWriter(self) if config.Config.DB_GROUP_COMMIT else None
+    
+    def _configure_sqlite(self):
+        """PRAGMA для каждого нового подключения SQLite"""
+        @event.listens_for(self.engine, 'connect')
+        def _set_sqlite_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            if config.Config.SQLITE_WAL:
+                cursor.execute('PRAGMA journal_mode=WAL')
+            cursor.execute(f'PRAGMA busy_timeout={int(config.Config.SQLITE_BUSY_TIMEOUT_MS)}')
+            if config.Config.SQLITE_SYNCHRONOUS in ('OFF', 'NORMAL', 'FULL', 'EXTRA'):
+                cursor.execute(f'PRAGMA synchronous={config.Config.SQLITE_SYNCHRONOUS}')
+            cursor.close()
+    
+    def _add_missing_columns(self):
+        """create_all не меняет существующие таблицы — добавляем новые колонки и индексы вручную"""
+        inspector = inspect(self.engine)
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            missing = [column for column in table.columns if column.name not in existing]
+            if missing:
+                with self.engine.begin() as conn:
+                    for column in missing:
+                        column_type = column.type.compile(dialect=self.engine.dialect)
+                        ddl = f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'
+                        if column.server_default is not None:
+                            ddl += f' DEFAULT {column.server_default.arg}'
+                        conn.execute(text(ddl))
+            existing_indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in existing_indexes:
+                    index.create(self.engine)
+    
+    def _ensure_orders_autoincrement(self):
+        """Базы SQLite, созданные до AUTOINCREMENT: пересоздаём orders с сохранением данных и id"""
+        with self.engine.connect() as conn:
+            conn = conn.execution_options(isolation_level='AUTOCOMMIT')
+            ddl = conn.execute(text("SELECT sql FROM sqlite_master WHERE type='table' AND name='orders'")).scalar()
+            if not ddl or 'AUTOINCREMENT' in ddl.upper():
+                return
+            logger.info("Rebuilding orders table with AUTOINCREMENT")
+            columns = ', '.join(column.name for column in Order.__table__.columns)
+            conn.execute(text('BEGIN IMMEDIATE'))
+            try:
+                # Триггеры поиска пересоздаст _setup_search; rowid заказов не меняются, индекс FTS остаётся верным
+                for (name,) in conn.execute(text(
+                    "SELECT name FROM sqlite_master WHERE type='trigger' AND tbl_name='orders'"
+                )).all():
+                    conn.execute(text(f'DROP TRIGGER "{name}"'))
+                conn.execute(text('ALTER TABLE orders RENAME TO orders_old'))
+                for (name,) in conn.execute(text(
+                    "SELECT name FROM sqlite_master WHERE type='index' AND tbl_name='orders_old' AND sql IS NOT NULL"
+                )).all():
+                    conn.execute(text(f'DROP INDEX "{name}"'))
+                Order.__table__.create(conn)
+                conn.execute(text(f'INSERT INTO orders ({columns}) SELECT {columns} FROM orders_old'))
+                conn.execute(text('DROP TABLE orders_old'))
+                conn.execute(text('COMMIT'))
+            except Exception:
+                conn.execute(text('ROLLBACK'))
+                raise
+    
+    def _setup_search(self):
+        """Индекс полнотекстового поиска по заказам: FTS5 в SQLite, pg_trgm в PostgreSQL.
+        Возвращает название механизма ('fts5', 'trgm' или 'like').
+        """
+        dialect = self.engine.dialect.name
+        try:
+            if dialect == 'sqlite':
+                with self.engine.begin() as conn:
+                    created = not conn.execute(text(
+                        "SELECT 1 FROM sqlite_master WHERE type='table' AND name='orders_fts'"
+                    )).first()
+                    for statement in SQLITE_SEARCH_DDL:
+                        conn.execute(text(statement))
+                    if created:
+                        # Индексируем уже существующие заказы
+                        conn.execute(text("INSERT INTO orders_fts(orders_fts) VALUES('rebuild')"))
+                return 'fts5'
+            if dialect == 'postgresql':
+                with self.engine.begin() as conn:
+                    conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+                    conn.execute(text(
+                        f"CREATE INDEX IF NOT EXISTS ix_orders_search_trgm ON orders "
+                        f"USING gin (({POSTGRES_SEARCH_EXPRESSION}) gin_trgm_ops)"
+                    ))
+                return 'trgm'
+        except Exception as e:
+            # Например, SQLite без FTS5 или нет прав на CREATE EXTENSION — ищем через LIKE
+            logger.warning(f"Full-text search index unavailable, falling back to LIKE: {e}")
+        return 'like'
     
     # Методы для заказов
-    def add_order(self, user_id, username, first_name, items, total_amount, phone=None, address=None):
-        order = Order(
-            user_id=user_id,
-            username=username,
-            first_name=first_name,
-            phone=phone,
-            address=address,
-            items=str(items),
-            total_amount=total_amount
-        )
-        self.session.add(order)
-        self.session.commit()
-        return order.id
+    def add_order(self, user_id, username, first_name, items, total_amount, phone=None, address=None,
+                  notification=None, idempotency_key=None):
+        """Создаёт заказ. notification — функция order_id -> dict(chat_id, text,
+        reply_markup, parse_mode): сообщение кладётся в outbox в той же транзакции.
+        Если заказ с таким idempotency_key уже есть, возвращается его id.
+        """
+        if idempotency_key:
+            existing = self.get_order_by_idempotency_key(idempotency_key)
+            if existing:
+                return existing.id
+        try:
+            order_id = self.insert_orders(self.session, [{
+                'user_id': user_id,
+                'username': username,
+                'first_name': first_name,
+                'items': items,
+                'total_amount': total_amount,
+                'phone': phone,
+                'address': address,
+                'notification': notification,
+                'idempotency_key': idempotency_key
+            }])[0]
+            self.session.commit()
+        except IntegrityError:
+            self.session.rollback()
+            # Параллельный запрос уже создал заказ с тем же ключом
+            existing = self.get_order_by_idempotency_key(idempotency_key) if idempotency_key else None
+            if existing:
+                return existing.id
+            raise
+        except Exception:
+            self.session.rollback()
+            raise
+        self.user_orders_cache.invalidate_user(user_id)
+        return order_id
+    
+    @staticmethod
+    def insert_orders(session, orders):
+        """Добавляет заказы (словари с аргументами add_order) и их сообщения в outbox
+        в текущую транзакцию session, не фиксируя её. Возвращает список id заказов.
+        """
+        objects = [
+            Order(
+                user_id=fields['user_id'],
+                username=fields.get('username'),
+                first_name=fields.get('first_name'),
+                phone=fields.get('phone'),
+                address=fields.get('address'),
+                items=str(fields['items']),
+                total_amount=fields['total_amount'],
+                idempotency_key=fields.get('idempotency_key')
+            )
+            for fields in orders
+        ]
+        session.add_all(objects)
+        # flush выдаёт id заказов, не завершая транзакцию (пачка уходит одним INSERT ... RETURNING)
+        session.flush()
+        messages = [
+            OutboxMessage(order_id=order.id, **fields['notification'](order.id))
+            for order, fields in zip(objects, orders) if fields.get('notification') is not None
+        ]
+        session.add_all(messages)
+        return [order.id for order in objects]
+    
+    def submit_order(self, **kwargs):
+        """Как add_order, но возвращает concurrent.futures.Future с id заказа.
+        С DB_GROUP_COMMIT заказ фиксируется одной транзакцией вместе с соседними.
+        """
+        if self.writer is not None:
+            return self.writer.add_order(**kwargs)
+        return _resolved_future(self.add_order, **kwargs)
+    
+    def _query_orders(self):
+        """Запрос заказов через общую сессию, перечитывающий уже загруженные объекты.
+        С DB_GROUP_COMMIT статус меняет сессия OrderWriter, а db.session не фиксируется и не
+        сбрасывается — без populate_existing заказ из identity map остался бы со старым статусом.
+        """
+        return self.session.query(Order).populate_existing()
+    
+    def get_order_by_idempotency_key(self, idempotency_key):
+        return self._query_orders().filter(Order.idempotency_key == idempotency_key).first()
     
     def get_order(self, order_id):
-        return self.session.query(Order).filter(Order.id == order_id).first()
-    
-    def update_order_status(self, order_id, status, printed_by=None):
-        order = self.get_order(order_id)
-        if order:
-            order.status = status
-            if status == 'printed':
-                order.printed_at = datetime.utcnow()
-                order.printed_by = printed_by
+        return self._query_orders().filter(Order.id == order_id).first()
+    
+    def update_order_status(self, order_id, status, printed_by=None, expected_version=None):
+        """Меняет статус одним UPDATE ... WHERE id=? AND status IN (...) [AND version=?].
+        Возвращает True, только если переход разрешён и никто не изменил заказ раньше.
+        """
+        if status not in ORDER_STATUS_TRANSITIONS:
+            return False
+        try:
+            updated = self.apply_status_update(self.session, order_id, status, printed_by, expected_version)
             self.session.commit()
-            return True
-        return False
+        except Exception:
+            self.session.rollback()
+            raise
+        if updated:
+            self.user_orders_cache.invalidate_order(order_id)
+        return updated
+    
+    @staticmethod
+    def apply_status_update(session, order_id, status, printed_by=None, expected_version=None):
+        """Условный UPDATE статуса в текущей транзакции session, без commit. True, если строка изменена."""
+        allowed_from = ORDER_STATUS_TRANSITIONS.get(status)
+        if not allowed_from:
+            return False
+        
+        values = {
+            Order.status: status,
+            Order.version: func.coalesce(Order.version, 0) + 1
+        }
+        if status == 'printed':
+            values[Order.printed_at] = datetime.utcnow()
+            values[Order.printed_by] = printed_by
+        
+        query = session.query(Order).filter(Order.id == order_id, Order.status.in_(allowed_from))
+        if expected_version is not None:
+            query = query.filter(func.coalesce(Order.version, 0) == expected_version)
+        return query.update(values, synchronize_session=False) == 1
+    
+    def submit_status_update(self, order_id, status, printed_by=None, expected_version=None):
+        """Как update_order_status, но возвращает Future с результатом (через group commit, если включён)"""
+        if self.writer is not None:
+            return self.writer.update_order_status(order_id, status, printed_by, expected_version)
+        return _resolved_future(self.update_order_status, order_id, status, printed_by, expected_version)
     
     def get_orders(self, status=None, limit=100):
-        query = self.session.query(Order).order_by(Order.created_at.desc())
+        query = self._query_orders().order_by(Order.created_at.desc())
         if status:
             query = query.filter(Order.status == status)
         return query.limit(limit).all()
 
+    def search_orders(self, query, limit=50):
+        """Поиск заказов по имени, @username, телефону и адресу, лучшие совпадения первыми"""
+        terms = [term.lstrip('@') for term in query.split()]
+        terms = [term for term in terms if term]
+        if not terms:
+            return []
+        
+        if self.search_backend == 'fts5':
+            # Каждое слово — префиксный поиск, все слова должны совпасть
+            match = ' '.join('"' + term.replace('"', '""') + '"*' for term in terms)
+            rows = self.session.execute(text(
+                "SELECT rowid FROM orders_fts WHERE orders_fts MATCH :match "
+                "ORDER BY bm25(orders_fts) LIMIT :limit"
+            ), {'match': match, 'limit': limit}).all()
+            ids = [row[0] for row in rows]
+            orders = {order.id: order for order in self._query_orders().filter(Order.id.in_(ids)).all()}
+            return [orders[order_id] for order_id in ids if order_id in orders]
+        
+        if self.search_backend == 'trgm':
+            expression = literal_column(f'({POSTGRES_SEARCH_EXPRESSION})')
+            search = self._query_orders()
+            for term in terms:
+                search = search.filter(expression.op('ILIKE')(literal(f'%{term}%')))
+            return search.order_by(
+                func.similarity(expression, ' '.join(terms)).desc(), Order.created_at.desc()
+            ).limit(limit).all()
+        
+        search = self._query_orders()
+        for term in terms:
+            pattern = f'%{term}%'
+            search = search.filter(
+                Order.first_name.ilike(pattern) | Order.username.ilike(pattern) |
+                Order.phone.ilike(pattern) | Order.address.ilike(pattern)
+            )
+        return search.order_by(Order.created_at.desc()).limit(limit).all()
+    
+    def get_user_orders(self, user_id, limit=10):
+        """Последние заказы покупателя (словари id/status/total_amount/created_at), с кэшем"""
+        cached = self.user_orders_cache.get(user_id, limit)
+        if cached is not None:
+            return cached
+        
+        rows = self.session.query(
+            Order.id, Order.status, Order.total_amount, Order.created_at
+        ).filter(Order.user_id == user_id).order_by(Order.created_at.desc()).limit(limit).all()
+        orders = [
+            {'id': row.id, 'status': row.status, 'total_amount': row.total_amount, 'created_at': row.created_at}
+            for row in rows
+        ]
+        self.user_orders_cache.put(user_id, limit, orders)
+        return orders
+
     def get_today_stats(self):
         """Возвращает простую статистику по заказам за текущие сутки (UTC):
         {'orders': int, 'revenue': float, 'by_status': {status: count}}
@@ -98,14 +513,14 @@ class Database:
             now_tz = datetime.now(tz)
             start_of_day_tz = now_tz.replace(hour=0, minute=0, second=0, microsecond=0)
             start_of_day_utc = start_of_day_tz.astimezone(timezone.utc).replace(tzinfo=None)
-            orders = self.session.query(Order).filter(Order.created_at >= start_of_day_utc).all()
+            orders = self._query_orders().filter(Order.created_at >= start_of_day_utc).all()
         else:
             # Если zoneinfo недоступен, считаем по UTC, но с поправкой +5 часов
             # Начало дня в Ташкенте соответствует UTC-5 часов назад
             now_utc = datetime.utcnow()
             # Считаем начало дня Ташкента в UTC
             start_of_day = (now_utc + timedelta(hours=5)).replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(hours=5)
-            orders = self.session.query(Order).filter(Order.created_at >= start_of_day).all()
+            orders = self._query_orders().filter(Order.created_at >= start_of_day).all()
 
         total_orders = len(orders)
         total_revenue = sum((o.total_amount or 0) for o in orders)
@@ -120,6 +535,40 @@ class Database:
             'by_status': status_counts
         }
     
+    # Методы для очереди исходящих сообщений
+    def get_pending_outbox(self, limit=50):
+        """Неотправленные сообщения, время повторной попытки которых наступило"""
+        return self.session.query(OutboxMessage).filter(
+            OutboxMessage.sent_at.is_(None),
+            OutboxMessage.next_attempt_at <= datetime.utcnow()
+        ).order_by(OutboxMessage.id).limit(limit).all()
+    
+    def get_next_outbox_attempt(self):
+        """Ближайшее время повторной попытки среди неотправленных сообщений"""
+        message = self.session.query(OutboxMessage).filter(
+            OutboxMessage.sent_at.is_(None)
+        ).order_by(OutboxMessage.next_attempt_at).first()
+        return message.next_attempt_at if message else None
+    
+    def mark_outbox_sent(self, message_id):
+        message = self.session.get(OutboxMessage, message_id)
+        if message:
+            message.sent_at = datetime.utcnow()
+            message.attempts = (message.attempts or 0) + 1
+            self.session.commit()
+            return True
+        return False
+    
+    def mark_outbox_failed(self, message_id, error, next_attempt_at):
+        message = self.session.get(OutboxMessage, message_id)
+        if message:
+            message.attempts = (message.attempts or 0) + 1
+            message.last_error = str(error)
+            message.next_attempt_at = next_attempt_at
+            self.session.commit()
+            return True
+        return False
+    
     # Методы для товаров
     def add_product(self, name, price, photo_url=None, category=None, description=None):
         product = Product(
@@ -161,6 +610,32 @@ class Database:
             return True
         return False
     
+    def get_product_by_sku(self, sku):
+        return self.session.query(Product).filter(Product.sku == sku).first()
+    
+    def sync_products(self, items):
+        """Создаёт и обновляет товары по каталогу config.Products.ITEMS (ключ каталога -> sku)"""
+        existing = {product.sku: product for product in self.session.query(Product).filter(Product.sku.isnot(None))}
+        for sku, item in items.items():
+            product = existing.get(sku)
+            if product is None:
+                product = Product(sku=sku)
+                self.session.add(product)
+            product.name = item['name']
+            product.price = item['price']
+            product.photo_url = item.get('photo_url')
+            product.category = item.get('category')
+            product.description = item.get('description')
+        self.session.commit()
+    
+    def set_product_photo_file_id(self, product_id, file_id):
+        product = self.get_product(product_id)
+        if product:
+            product.photo_file_id = file_id
+            self.session.commit()
+            return True
+        return False
+    
     def toggle_product_availability(self, product_id):
         product = self.get_product(product_id)
         if product:
@@ -170,5 +645,37 @@ class Database:
             return True
         return False
 
-# Инициализация базы данных
-db = Database()
\ No newline at end of file
+def _resolved_future(func, *args, **kwargs):
+    """Выполняет func сразу и возвращает завершённый Future с её результатом"""
+    future = Future()
+    try:
+        future.set_result(func(*args, **kwargs))
+    except Exception as e:
+        future.set_exception(e)
+    return future
+
+def create_db(db_url=None):
+    """Создаёт подключение к БД и недостающие таблицы"""
+    return Database(db_url)
+
+_db = None
+_db_lock = threading.Lock()
+
+def get_db():
+    """Общий для процесса экземпляр Database, создаётся при первом обращении"""
+    global _db
+    if _db is None:
+        # Админка (поток Flask) и бот могут обратиться к БД одновременно
+        with _db_lock:
+            if _db is None:
+                _db = create_db()
+    return _db
+
+class _LazyDatabase:
+    """Прокси для `from database import db`: импорт модуля не подключается к БД"""
+    
+    def __getattr__(self, name):
+        return getattr(get_db(), name)
+
+# Инициализация базы данных откладывается до первого обращения
+db = _LazyDatabase()
@@ -0,0 +1,125 @@
+"""Общая настройка логирования для bot.py, start.py и printer_server.py.
+
+Обработчики и форматирование не выполняются в потоке, который пишет в лог:
+запись кладётся в очередь (QueueHandler), а в консоль и файл её выводит фоновый
+поток (QueueListener). Зависший диск не задерживает обработку апдейтов и печать.
+В файл записи пишутся JSON-строками с ротацией по размеру или по времени.
+"""
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+from datetime import datetime, timezone
+
+import config
+import metrics
+import tracing
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+_listeners = []
+_configured = False
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись — одна JSON-строка"""
+
+    def __init__(self, service):
+        super().__init__()
+        self.service = service
+
+    def format(self, record):
+        data = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'service': self.service,
+            'message': record.getMessage(),
+        }
+        trace_id = getattr(record, 'trace_id', None)
+        if trace_id:
+            data['trace_id'] = trace_id
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data['exc_info'] = record.exc_text
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler, который никогда не ждёт: при переполненной очереди запись отбрасывается"""
+
+    def prepare(self, record):
+        # Сообщение и traceback готовим здесь: аргументы могут измениться, пока запись ждёт в очереди
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        # contextvars доступны только в потоке, который пишет в лог
+        record.trace_id = tracing.get_trace_id()
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.LOG_RECORDS_DROPPED.inc()
+
+
+def file_handler(path, formatter):
+    """Файл с ротацией: по времени, если задан LOG_ROTATE_WHEN, иначе по размеру"""
+    if config.Config.LOG_ROTATE_WHEN:
+        handler = logging.handlers.TimedRotatingFileHandler(
+            path, when=config.Config.LOG_ROTATE_WHEN, backupCount=config.Config.LOG_BACKUP_COUNT, encoding='utf-8'
+        )
+    else:
+        handler = logging.handlers.RotatingFileHandler(
+            path, maxBytes=config.Config.LOG_MAX_BYTES, backupCount=config.Config.LOG_BACKUP_COUNT, encoding='utf-8'
+        )
+    handler.setFormatter(formatter)
+    return handler
+
+
+def queued(*handlers):
+    """QueueHandler, записи из которого выводит в handlers отдельный поток"""
+    log_queue = queue.Queue(maxsize=config.Config.LOG_QUEUE_SIZE)
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    if not _listeners:
+        atexit.register(stop_logging)
+    _listeners.append(listener)
+    return NonBlockingQueueHandler(log_queue)
+
+
+def setup_logging(service, log_file=None):
+    """Настраивает корневой логгер процесса. Повторные вызовы ничего не меняют."""
+    global _configured
+    if _configured:
+        return
+    _configured = True
+
+    console = logging.StreamHandler(sys.stderr)
+    if config.Config.LOG_FORMAT == 'json':
+        console.setFormatter(JsonFormatter(service))
+    else:
+        console.setFormatter(logging.Formatter(TEXT_FORMAT))
+    handlers = [console]
+
+    log_file = log_file or config.Config.LOG_FILE
+    if log_file:
+        handlers.append(file_handler(log_file, JsonFormatter(service)))
+
+    root = logging.getLogger()
+    root.setLevel(config.Config.LOG_LEVEL)
+    root.addHandler(queued(*handlers))
+
+
+def stop_logging():
+    """Дописывает записи из очередей (вызывается при выходе)"""
+    while _listeners:
+        _listeners.pop().stop()
@@ -0,0 +1,285 @@
+import time
+import threading
+from bisect import bisect_left
+
+# Формат text/plain, который понимает Prometheus
+CONTENT_TYPE_LATEST = 'text/plain; version=0.0.4; charset=utf-8'
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(label_names, label_values, extra=None):
+    pairs = list(zip(label_names, label_values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = []
+    for name, value in pairs:
+        value = str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+        escaped.append(f'{name}="{value}"')
+    return '{' + ','.join(escaped) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    metric_type = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name}: ожидались метки {self.labelnames}, получены {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self):
+        lines = [
+            f'# HELP {self.name} {self.documentation}',
+            f'# TYPE {self.name} {self.metric_type}',
+        ]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_sample(key, value))
+        return lines
+
+    def _render_sample(self, key, value):
+        return [f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}']
+
+
+class Counter(_Metric):
+    """Монотонно растущий счётчик"""
+    metric_type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+
+class Gauge(_Metric):
+    """Значение, которое может расти и уменьшаться (например, глубина очереди)"""
+    metric_type = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+
+class Histogram(_Metric):
+    """Гистограмма длительностей с кумулятивными корзинами"""
+    metric_type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS, registry=None):
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        super().__init__(name, documentation, labelnames, registry)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            state['counts'][index] += 1
+            state['sum'] += value
+            state['count'] += 1
+
+    def time(self, **labels):
+        """Контекстный менеджер: измеряет время выполнения блока"""
+        return _Timer(self, labels)
+
+    def _render_sample(self, key, state):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, state['counts']):
+            cumulative += count
+            labels = _format_labels(self.labelnames, key, ('le', _format_value(float(bound))))
+            lines.append(f'{self.name}_bucket{labels} {cumulative}')
+        labels = _format_labels(self.labelnames, key)
+        lines.append(f'{self.name}_sum{labels} {_format_value(state["sum"])}')
+        lines.append(f'{self.name}_count{labels} {state["count"]}')
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.elapsed = time.perf_counter() - self.start
+        self.histogram.observe(self.elapsed, **self.labels)
+        return False
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Метрика {metric.name} уже зарегистрирована")
+            self._metrics[metric.name] = metric
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+def generate_latest(registry=None):
+    """Текст всех метрик процесса в формате Prometheus"""
+    return (registry or REGISTRY).render()
+
+
+# Метрики бота
+HANDLER_LATENCY = Histogram(
+    'bot_handler_duration_seconds', 'Время выполнения обработчиков aiogram', ['handler']
+)
+HANDLER_ERRORS = Counter(
+    'bot_handler_errors_total', 'Количество исключений в обработчиках aiogram', ['handler']
+)
+
+UPDATE_QUEUE_DEPTH = Gauge(
+    'bot_update_queue_depth', 'Апдейтов в очередях воркеров, ожидающих обработки'
+)
+
+LOG_RECORDS_DROPPED = Counter(
+    'log_records_dropped_total', 'Записей лога, отброшенных из-за переполненной очереди'
+)
+
+# Метрики базы данных
+DB_QUERY_LATENCY = Histogram(
+    'db_query_duration_seconds', 'Время выполнения SQL-запросов', ['operation']
+)
+DB_COMMIT_BATCH_SIZE = Histogram(
+    'db_commit_batch_size', 'Записей в одной транзакции group commit',
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200)
+)
+
+# Метрики принтера
+PRINTER_CONNECT_LATENCY = Histogram(
+    'printer_connect_duration_seconds', 'Время подключения к принтеру'
+)
+PRINTER_SEND_LATENCY = Histogram(
+    'printer_send_duration_seconds', 'Время отправки чека на принтер'
+)
+PRINTER_ERRORS = Counter(
+    'printer_errors_total', 'Количество ошибок печати'
+)
+PRINTER_QUEUE_DEPTH = Gauge(
+    'printer_queue_depth', 'Количество чеков, ожидающих или выполняющих печать'
+)
+
+PRINTER_BREAKER_OPEN = Gauge(
+    'printer_breaker_open', '1, если бот считает принтер офлайн (выключатель разомкнут)'
+)
+PRINTER_PARKED = Gauge(
+    'printer_parked_requests', 'Чеков, отложенных до восстановления принтера'
+)
+
+# Метрики очереди сообщений в канал
+OUTBOX_SENT = Counter(
+    'outbox_sent_total', 'Сообщений из outbox доставлено в Telegram'
+)
+OUTBOX_FAILED = Counter(
+    'outbox_failed_total', 'Неудачных попыток отправки из outbox (будут повторены)'
+)
+OUTBOX_RETRY_AFTER = Counter(
+    'outbox_retry_after_total', 'Ответов RetryAfter (flood control) от Telegram'
+)
+
+
+def instrument_engine(engine):
+    """Вешает на engine SQLAlchemy хуки, измеряющие время каждого запроса"""
+    from sqlalchemy import event
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_start_time', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get('query_start_time')
+        if not starts:
+            return
+        elapsed = time.perf_counter() - starts.pop()
+        operation = statement.lstrip().split(' ', 1)[0].upper() or 'UNKNOWN'
+        DB_QUERY_LATENCY.observe(elapsed, operation=operation)
+
+    @event.listens_for(engine, 'handle_error')
+    def _handle_error(context):
+        # Не даём стеку времён расти, если запрос упал
+        starts = context.connection.info.get('query_start_time') if context.connection else None
+        if starts:
+            starts.pop()
+
+    return engine
+
+
+def _handler_name(data):
+    handler = data.get('handler')
+    callback = getattr(handler, 'callback', None)
+    return getattr(callback, '__name__', 'unknown')
+
+
+class MetricsMiddleware:
+    """Inner-middleware aiogram: время и ошибки каждого обработчика.
+
+    Не наследуется от aiogram.BaseMiddleware, чтобы импорт metrics не тянул aiogram
+    (модуль используется и в printer_server). aiogram принимает любой такой callable.
+    """
+
+    async def __call__(self, handler, event, data):
+        name = _handler_name(data)
+        start = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            HANDLER_ERRORS.inc(handler=name)
+            raise
+        finally:
+            HANDLER_LATENCY.observe(time.perf_counter() - start, handler=name)
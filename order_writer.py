@@ -0,0 +1,164 @@
+"""Group commit для заказов.
+
+Каждый commit в SQLite — это fsync, поэтому при потоке заказов база упирается в диск.
+OrderWriter собирает новые заказы и смены статуса из бота и админки в течение
+DB_GROUP_COMMIT_INTERVAL_MS и фиксирует их одной транзакцией в отдельном потоке.
+Вызывающий получает concurrent.futures.Future: в asyncio его ждут через
+asyncio.wrap_future, во Flask — через future.result().
+"""
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import sessionmaker
+
+import config
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class OrderWriter:
+    """Фоновый поток, который пишет заказы в БД пачками"""
+
+    def __init__(self, db, interval_ms=None, max_batch=None):
+        self.db = db
+        interval_ms = interval_ms if interval_ms is not None else config.Config.DB_GROUP_COMMIT_INTERVAL_MS
+        self.interval = interval_ms / 1000.0
+        self.max_batch = max_batch or config.Config.DB_GROUP_COMMIT_MAX_BATCH
+        # Своя сессия: пишем из отдельного потока, не трогая db.session бота
+        self._Session = sessionmaker(bind=db.engine)
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def add_order(self, **kwargs):
+        """Future с id заказа; аргументы — как у Database.add_order"""
+        return self._submit('insert', kwargs)
+
+    def update_order_status(self, order_id, status, printed_by=None, expected_version=None):
+        """Future с True/False — как у Database.update_order_status"""
+        return self._submit('status', {
+            'order_id': order_id,
+            'status': status,
+            'printed_by': printed_by,
+            'expected_version': expected_version,
+        })
+
+    def _submit(self, kind, kwargs):
+        future = Future()
+        self._ensure_started()
+        self._queue.put((kind, kwargs, future))
+        return future
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='order-writer', daemon=True)
+                self._thread.start()
+
+    def close(self, timeout=5):
+        """Дописывает накопленное и останавливает поток"""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(None)
+            thread.join(timeout)
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            # Ждём соседей не дольше interval с момента первой записи в пачке
+            deadline = time.monotonic() + self.interval
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            # Отменённые вызывающим (например, по таймауту) записи не выполняем
+            batch = [item for item in batch if item[2].set_running_or_notify_cancel()]
+            if batch:
+                self._commit_batch(batch)
+
+    def _write(self, session, batch):
+        """Выполняет пачку в session без commit. Возвращает результаты в порядке пачки."""
+        Order = self.db.Order
+        results = [None] * len(batch)
+        inserts = [index for index, (kind, _, _) in enumerate(batch) if kind == 'insert']
+
+        # Повторы по ключу идемпотентности: уже в БД или дважды в этой же пачке
+        keys = {batch[index][1]['idempotency_key'] for index in inserts if batch[index][1].get('idempotency_key')}
+        known = {}
+        if keys:
+            known = dict(session.query(Order.idempotency_key, Order.id).filter(Order.idempotency_key.in_(keys)).all())
+        new, duplicates, new_keys = [], [], set()
+        for index in inserts:
+            key = batch[index][1].get('idempotency_key')
+            if key in known:
+                results[index] = known[key]
+            elif key and key in new_keys:
+                duplicates.append(index)
+            else:
+                new.append(index)
+                if key:
+                    new_keys.add(key)
+
+        if new:
+            ids = self.db.insert_orders(session, [batch[index][1] for index in new])
+            for index, order_id in zip(new, ids):
+                results[index] = order_id
+                if batch[index][1].get('idempotency_key'):
+                    known[batch[index][1]['idempotency_key']] = order_id
+        for index in duplicates:
+            results[index] = known[batch[index][1]['idempotency_key']]
+
+        for index, (kind, kwargs, _) in enumerate(batch):
+            if kind == 'status':
+                results[index] = self.db.apply_status_update(session, **kwargs)
+        return results
+
+    def _commit_batch(self, batch):
+        session = self._Session()
+        try:
+            results = self._write(session, batch)
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            session.close()
+            if len(batch) > 1:
+                # Одна плохая запись не должна ронять соседей — повторяем по одной
+                logger.warning(f"Group commit of {len(batch)} writes failed, retrying one by one: {e}")
+                for item in batch:
+                    self._commit_batch([item])
+                return
+            kind, kwargs, future = batch[0]
+            if kind == 'insert' and isinstance(e, IntegrityError) and kwargs.get('idempotency_key'):
+                # Заказ с тем же ключом успели записать в обход writer
+                existing = self._find_by_idempotency_key(kwargs['idempotency_key'])
+                if existing is not None:
+                    future.set_result(existing)
+                    return
+            future.set_exception(e)
+            return
+        session.close()
+
+        metrics.DB_COMMIT_BATCH_SIZE.observe(len(batch))
+        for (kind, kwargs, future), result in zip(batch, results):
+            if kind == 'insert':
+                self.db.user_orders_cache.invalidate_user(kwargs['user_id'])
+            elif result:
+                self.db.user_orders_cache.invalidate_order(kwargs['order_id'])
+            future.set_result(result)
@@ -0,0 +1,133 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.types import InlineKeyboardMarkup
+
+import config
+import metrics
+import tracing
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Ограничитель частоты: rate токенов в секунду, не больше capacity подряд"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    async def acquire(self):
+        while True:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds):
+        """Опустошает ведро так, чтобы следующий токен появился через seconds"""
+        self.tokens = -seconds * self.rate
+        self.updated_at = time.monotonic()
+
+
+class OutboxSender:
+    """Фоновая отправка сообщений из таблицы outbox с учётом лимитов Telegram"""
+
+    def __init__(self, bot, db, rate_per_minute=None, burst=None, poll_interval=5.0,
+                 retry_base=5.0, retry_max=300.0):
+        rate_per_minute = rate_per_minute or config.Config.OUTBOX_RATE_PER_MINUTE
+        self.bot = bot
+        self.db = db
+        self.bucket = TokenBucket(rate_per_minute / 60.0, burst or config.Config.OUTBOX_BURST)
+        self.poll_interval = poll_interval
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self._wakeup = asyncio.Event()
+
+    def notify(self):
+        """Будит отправителя сразу после появления нового сообщения"""
+        self._wakeup.set()
+
+    async def send_one(self, message):
+        """Отправляет одно сообщение. Возвращает True, если оно доставлено."""
+        reply_markup = None
+        if message.reply_markup:
+            reply_markup = InlineKeyboardMarkup.model_validate_json(message.reply_markup)
+
+        while True:
+            await self.bucket.acquire()
+            waited = (datetime.utcnow() - message.created_at).total_seconds() if message.created_at else None
+            try:
+                with tracing.span('outbox.send', trace_id=message.trace_id, order_id=message.order_id,
+                                  attempt=(message.attempts or 0) + 1,
+                                  waited_ms=round(waited * 1000, 3) if waited is not None else None):
+                    await self.bot.send_message(
+                        chat_id=message.chat_id,
+                        text=message.text,
+                        reply_markup=reply_markup,
+                        parse_mode=message.parse_mode
+                    )
+            except TelegramRetryAfter as e:
+                # Telegram сам говорит, сколько ждать — ждём и пробуем снова
+                metrics.OUTBOX_RETRY_AFTER.inc()
+                logger.warning(f"Outbox flood control, retry after {e.retry_after}s (message #{message.id})")
+                self.bucket.pause(e.retry_after)
+                continue
+            except Exception as e:
+                delay = min(self.retry_max, self.retry_base * 2 ** (message.attempts or 0))
+                self.db.mark_outbox_failed(message.id, e, datetime.utcnow() + timedelta(seconds=delay))
+                metrics.OUTBOX_FAILED.inc()
+                logger.error(f"Outbox send error for message #{message.id} (order #{message.order_id}): {e}. Retry in {delay:.0f}s")
+                return False
+
+            self.db.mark_outbox_sent(message.id)
+            metrics.OUTBOX_SENT.inc()
+            return True
+
+    async def drain(self):
+        """Отправляет все сообщения, время которых наступило. Возвращает число отправленных."""
+        sent = 0
+        while True:
+            batch = self.db.get_pending_outbox()
+            if not batch:
+                return sent
+            progressed = False
+            for message in batch:
+                if await self.send_one(message):
+                    sent += 1
+                    progressed = True
+            if not progressed:
+                return sent
+
+    def _sleep_interval(self):
+        next_attempt = self.db.get_next_outbox_attempt()
+        if next_attempt is None:
+            return self.poll_interval
+        delay = (next_attempt - datetime.utcnow()).total_seconds()
+        return max(0.0, min(self.poll_interval, delay))
+
+    async def run(self):
+        logger.info("Outbox sender started")
+        while True:
+            self._wakeup.clear()
+            try:
+                await self.drain()
+                interval = self._sleep_interval()
+            except Exception as e:
+                logger.error(f"Outbox sender error: {e}")
+                interval = self.poll_interval
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=interval)
+            except asyncio.TimeoutError:
+                pass
@@ -0,0 +1,170 @@
+"""Клиент сервера печати с автоматическим выключателем (circuit breaker).
+
+Если сервер печати или принтер недоступен, каждое нажатие «Распечатать чек»
+ждало бы полный таймаут. После PRINTER_BREAKER_FAILURES ошибок подряд выключатель
+размыкается: запросы сразу завершаются PrinterUnavailable, а фоновая проверка
+/health замыкает его, когда принтер вернётся. С PRINTER_PARK_REQUESTS печать,
+запрошенная во время простоя, откладывается и выполняется после восстановления.
+"""
+import asyncio
+import logging
+import time
+
+import config
+import metrics
+import tracing
+
+logger = logging.getLogger(__name__)
+
+
+class PrinterUnavailable(Exception):
+    """Выключатель разомкнут — принтер считается офлайн"""
+
+
+class CircuitBreaker:
+    """closed — запросы идут; open — сразу отказ; half_open — пропускается один пробный запрос"""
+
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = None
+
+    def allow(self):
+        if self.state == 'closed':
+            return True
+        if self.state == 'open' and time.monotonic() - self.opened_at >= self.reset_timeout:
+            # Проверка /health могла не успеть — пропускаем один запрос на пробу
+            self.state = 'half_open'
+            return True
+        return False
+
+    def record_success(self):
+        """Возвращает True, если выключатель только что замкнулся"""
+        was_open = self.state != 'closed'
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = None
+        metrics.PRINTER_BREAKER_OPEN.set(0)
+        return was_open
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == 'half_open' or self.failures >= self.failure_threshold:
+            if self.state != 'open':
+                logger.warning(f"Printer circuit breaker opened after {self.failures} failures")
+            self.state = 'open'
+            self.opened_at = time.monotonic()
+            metrics.PRINTER_BREAKER_OPEN.set(1)
+
+    @property
+    def is_open(self):
+        return self.state != 'closed'
+
+
+class PrinterClient:
+    """Отправка чеков на PRINTER_API_URL/print через выключатель"""
+
+    def __init__(self, base_url=None, api_key=None, timeout=None, failure_threshold=None, reset_timeout=None,
+                 probe_interval=None, park_requests=None):
+        self.base_url = (base_url or config.Config.PRINTER_API_URL).rstrip('/')
+        self.api_key = api_key or config.Config.API_SECRET_KEY
+        self.timeout = timeout or config.Config.PRINTER_TIMEOUT
+        self.breaker = CircuitBreaker(
+            failure_threshold or config.Config.PRINTER_BREAKER_FAILURES,
+            reset_timeout or config.Config.PRINTER_BREAKER_RESET_SECONDS
+        )
+        self.probe_interval = probe_interval or config.Config.PRINTER_HEALTH_INTERVAL
+        self.park_requests = park_requests if park_requests is not None else config.Config.PRINTER_PARK_REQUESTS
+        # order_id -> корутинная функция без аргументов, повторяющая печать
+        self._parked = {}
+        self._replaying = False
+
+    def _post(self, receipt_data, headers):
+        # requests импортируется только при первой печати — это ускоряет запуск бота
+        import requests
+        return requests.post(f"{self.base_url}/print", json=receipt_data, headers=headers, timeout=self.timeout)
+
+    def _health(self):
+        import requests
+        return requests.get(f"{self.base_url}/health", timeout=self.timeout)
+
+    async def print_receipt(self, receipt_data):
+        """Отправляет чек, возвращает ответ сервера печати. Пока принтер офлайн — PrinterUnavailable."""
+        if not self.breaker.allow():
+            raise PrinterUnavailable("Принтер офлайн")
+
+        headers = {
+            "X-API-Key": self.api_key,
+            "Authorization": f"Bearer {self.api_key}",
+            # Сервер печати пишет свои спаны в ту же трассу
+            tracing.TRACE_HEADER: tracing.get_trace_id() or tracing.new_trace_id()
+        }
+        with tracing.span('printer.request', order_id=receipt_data.get('order_id')) as span:
+            try:
+                # В отдельном потоке: ожидание принтера не блокирует обработку других апдейтов
+                response = await asyncio.to_thread(self._post, receipt_data, headers)
+            except Exception:
+                self.breaker.record_failure()
+                raise
+            span.attrs['status_code'] = response.status_code
+
+        # 5xx — сервер печати не смог напечатать (принтер не отвечает); 4xx — ошибка запроса
+        if response.status_code >= 500:
+            self.breaker.record_failure()
+        elif self.breaker.record_success():
+            self._on_recovered()
+        return response
+
+    def park(self, order_id, job):
+        """Откладывает печать заказа до восстановления принтера"""
+        self._parked[order_id] = job
+        metrics.PRINTER_PARKED.set(len(self._parked))
+        logger.info(f"Print of order #{order_id} parked until the printer is back ({len(self._parked)} parked)")
+
+    def _on_recovered(self):
+        logger.info("Printer is back online")
+        if self._parked and not self._replaying:
+            asyncio.create_task(self.replay_parked())
+
+    async def replay_parked(self):
+        """Выполняет отложенную печать по порядку, пока принтер снова не откажет"""
+        self._replaying = True
+        try:
+            while self._parked and not self.breaker.is_open:
+                order_id = next(iter(self._parked))
+                job = self._parked.pop(order_id)
+                metrics.PRINTER_PARKED.set(len(self._parked))
+                try:
+                    await job()
+                    logger.info(f"Parked print of order #{order_id} replayed")
+                except PrinterUnavailable:
+                    self.park(order_id, job)
+                    break
+                except Exception as e:
+                    logger.error(f"Parked print of order #{order_id} failed: {e}")
+                    if self.breaker.is_open:
+                        self.park(order_id, job)
+                        break
+        finally:
+            self._replaying = False
+
+    async def probe(self):
+        """Одна проверка /health; замыкает выключатель, если принтер доступен"""
+        try:
+            response = await asyncio.to_thread(self._health)
+            healthy = response.status_code == 200
+        except Exception as e:
+            logger.debug(f"Printer health probe failed: {e}")
+            healthy = False
+        if healthy and self.breaker.record_success():
+            self._on_recovered()
+        return healthy
+
+    async def run_health_probe(self):
+        """Фоновая задача: пока выключатель разомкнут, проверяет /health каждые probe_interval секунд"""
+        while True:
+            await asyncio.sleep(self.probe_interval)
+            if self.breaker.is_open:
+                await self.probe()
@@ -1,4 +1,4 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 from flask_httpauth import HTTPTokenAuth
 from flask_cors import CORS
 import socket
@@ -6,22 +6,15 @@ import json
 import logging
 from datetime import datetime
 import config
+import metrics
+import tracing
+from logging_setup import setup_logging
 try:
     from zoneinfo import ZoneInfo
     TZ = ZoneInfo('Asia/Tashkent')
 except Exception:
     TZ = None
 
-# Настройка логирования
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('printer_server.log'),
-        logging.StreamHandler()
-    ]
-)
-
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
@@ -40,22 +33,31 @@ class ReceiptPrinter:
     
     def print_receipt(self, order_data):
         """Формирует и отправляет чек на принтер"""
+        metrics.PRINTER_QUEUE_DEPTH.inc()
+        order_id = order_data.get('order_id')
         try:
             # Формируем текст чека
-            receipt_bytes = self._format_receipt_bytes(order_data)
+            with tracing.span('printer.format', order_id=order_id):
+                receipt_bytes = self._format_receipt_bytes(order_data)
             
             # Подключаемся к принтеру
             with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
                 sock.settimeout(10)
-                sock.connect((self.host, self.port))
-                sock.sendall(receipt_bytes)
+                with metrics.PRINTER_CONNECT_LATENCY.time(), tracing.span('printer.connect', order_id=order_id):
+                    sock.connect((self.host, self.port))
+                with metrics.PRINTER_SEND_LATENCY.time(), \
+                        tracing.span('printer.send', order_id=order_id, bytes=len(receipt_bytes)):
+                    sock.sendall(receipt_bytes)
                 
             logger.info(f"Receipt printed successfully for order #{order_data['order_id']}")
             return True
             
         except Exception as e:
+            metrics.PRINTER_ERRORS.inc()
             logger.error(f"Print error for order #{order_data.get('order_id', 'unknown')}: {str(e)}")
             return False
+        finally:
+            metrics.PRINTER_QUEUE_DEPTH.dec()
     
     def _format_receipt_bytes(self, order_data):
         """Форматирует чек в байты для ESC/POS принтера"""
@@ -139,6 +141,17 @@ printer = ReceiptPrinter()
 @app.route('/print', methods=['POST'])
 @auth.login_required
 def print_receipt():
+    # Trace id от бота: спаны печати попадают в трассу нажатия «Распечатать чек»
+    token = tracing.set_trace_id(request.headers.get(tracing.TRACE_HEADER) or tracing.new_trace_id())
+    try:
+        with tracing.span('printer.handle_request') as span:
+            response = _print_receipt_response()
+            span.attrs['order_id'] = (request.get_json(silent=True) or {}).get('order_id')
+            return response
+    finally:
+        tracing.reset_trace_id(token)
+
+def _print_receipt_response():
     try:
         if not request.json:
             return jsonify({"status": "error", "message": "No JSON data provided"}), 400
@@ -189,6 +202,11 @@ def health_check():
             "timestamp": datetime.utcnow().isoformat()
         }), 503
 
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Метрики принтера в формате Prometheus"""
+    return Response(metrics.generate_latest(), mimetype=metrics.CONTENT_TYPE_LATEST)
+
 @app.route('/test-print', methods=['POST'])
 @auth.login_required
 def test_print():
@@ -220,5 +238,8 @@ def test_print():
         return jsonify({"status": "error", "message": str(e)}), 500
 
 if __name__ == '__main__':
+    # Лог в printer_server.log с ротацией; пишется фоновым потоком, а не в обработчике /print
+    setup_logging('printer', config.Config.LOG_FILE or 'printer_server.log')
     logger.info("Starting Printer Server...")
+    tracing.configure('printer')
     app.run(host='0.0.0.0', port=5000, debug=False)
\ No newline at end of file
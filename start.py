@@ -1,20 +1,60 @@
 import os
+import sys
+import time
 import asyncio
 from threading import Thread
 
-# Import the Flask admin app and the bot module
-from admin_panel import app as admin_app
-import bot
-
 
 def run_flask():
+    # Flask and the admin module are imported in the thread, so the bot does not wait for them
+    from admin_panel import create_admin_app
+
+    admin_app = create_admin_app()
     port = int(os.getenv('PORT', '8080'))
     debug = os.getenv('FLASK_DEBUG', 'false').lower() in ('1', 'true', 'yes')
     # When running inside a thread, disable reloader
     admin_app.run(host='0.0.0.0', port=port, debug=debug, use_reloader=False)
 
 
+def profile_startup():
+    """Prints how long each startup step takes (imports and app factories)"""
+    import importlib
+
+    steps = [
+        ('import config', lambda: importlib.import_module('config')),
+        ('import database', lambda: importlib.import_module('database')),
+        ('import bot', lambda: importlib.import_module('bot')),
+        ('import admin_panel', lambda: importlib.import_module('admin_panel')),
+        ('create_db()', lambda: importlib.import_module('database').get_db()),
+        ('create_bot()', lambda: importlib.import_module('bot').create_bot()),
+        ('create_admin_app()', lambda: importlib.import_module('admin_panel').create_admin_app()),
+    ]
+    total = 0.0
+    print(f"{'Step':<24}{'ms':>10}")
+    for name, step in steps:
+        start = time.perf_counter()
+        try:
+            step()
+            error = ''
+        except Exception as e:
+            error = f'  error: {e}'
+        elapsed = (time.perf_counter() - start) * 1000
+        total += elapsed
+        print(f"{name:<24}{elapsed:>10.1f}{error}")
+    print(f"{'total':<24}{total:>10.1f}")
+    print("\nPer-module breakdown: python -X importtime start.py --profile-imports")
+
+
 if __name__ == '__main__':
+    if '--profile-imports' in sys.argv:
+        profile_startup()
+        sys.exit(0)
+
+    from logging_setup import setup_logging
+    setup_logging('bot')
+
+    import bot
+
     # Запускаем админ-панель в отдельном потоке
     flask_thread = Thread(target=run_flask, daemon=True)
     flask_thread.start()
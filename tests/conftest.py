@@ -0,0 +1,8 @@
+import os
+import sys
+
+# config читает переменные окружения при импорте
+os.environ.setdefault('BOT_TOKEN', '123456:TEST')
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
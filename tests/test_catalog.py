@@ -0,0 +1,42 @@
+from catalog import Catalog
+
+ITEMS = {
+    'item_1': {'name': 'Торт "Наполеон"', 'price': 350, 'category': 'Торты'},
+    'item_2': {'name': 'Эклер шоколадный', 'price': 120, 'category': 'Пирожные'},
+    'item_3': {'name': 'Эклер ванильный', 'price': 110, 'category': 'Пирожные'},
+    'item_4': {'name': 'Пирожное "Картошка"', 'price': 80, 'category': 'Пирожные'},
+    'item_5': {'name': 'Чизкейк', 'price': 250},
+}
+
+
+def nums(results):
+    return [num for num, _, _ in results]
+
+
+def test_numbers_and_categories_follow_items_order():
+    catalog = Catalog(ITEMS, page_size=2)
+    assert catalog.get('2') == ('item_2', ITEMS['item_2'])
+    assert catalog.get('99') is None
+    assert catalog.categories == [('Торты', [1]), ('Пирожные', [2, 3, 4]), ('Другое', [5])]
+    assert catalog.page_count(1) == 2
+    assert nums(catalog.page(1, 1)) == [4]
+
+
+def test_prefix_search():
+    catalog = Catalog(ITEMS)
+    assert nums(catalog.search('экл')) == [2, 3]
+    assert nums(catalog.search('Эклер шок')) == [2]
+    assert nums(catalog.search('наполеон')) == [1]
+
+
+def test_typo_search():
+    catalog = Catalog(ITEMS)
+    assert nums(catalog.search('эклор')) == [2, 3]
+    assert nums(catalog.search('картожка')) == [4]
+    assert catalog.search('макарон') == []
+
+
+def test_empty_query_pages_whole_catalog():
+    catalog = Catalog(ITEMS)
+    assert nums(catalog.search('')) == [1, 2, 3, 4, 5]
+    assert nums(catalog.search('', limit=2, offset=2)) == [3, 4]
@@ -0,0 +1,103 @@
+from concurrent.futures import Future
+
+import pytest
+from sqlalchemy.exc import IntegrityError
+
+from database import Database
+from order_writer import OrderWriter
+
+
+@pytest.fixture
+def db(tmp_path):
+    return Database(f"sqlite:///{tmp_path / 'orders.db'}")
+
+
+@pytest.fixture
+def writer(db):
+    writer = OrderWriter(db, interval_ms=100, max_batch=100)
+    yield writer
+    writer.close()
+
+
+def order(user_id=1, **kwargs):
+    fields = {'user_id': user_id, 'username': 'user', 'first_name': 'Иван', 'items': '[]', 'total_amount': 100}
+    fields.update(kwargs)
+    return fields
+
+
+def commit(writer, *items):
+    """Фиксирует items одной пачкой, как это делает поток writer"""
+    batch = [(kind, kwargs, Future()) for kind, kwargs in items]
+    for _, _, future in batch:
+        future.set_running_or_notify_cancel()
+    writer._commit_batch(batch)
+    return [future for _, _, future in batch]
+
+
+def test_duplicate_keys_in_one_batch_create_one_order(db, writer):
+    futures = commit(
+        writer,
+        ('insert', order(idempotency_key='cart-1')),
+        ('insert', order(idempotency_key='cart-1')),
+        ('insert', order(idempotency_key='cart-2')),
+    )
+    first, duplicate, other = [future.result() for future in futures]
+    assert first == duplicate
+    assert other != first
+    assert db.session.query(db.Order).count() == 2
+
+
+def test_key_already_in_db_returns_existing_order(db, writer):
+    existing = db.add_order(**order(idempotency_key='cart-1'))
+    [future] = commit(writer, ('insert', order(idempotency_key='cart-1')))
+    assert future.result() == existing
+    assert db.session.query(db.Order).count() == 1
+
+
+def test_bad_insert_does_not_fail_its_neighbours(db, writer):
+    good_before, bad, good_after = commit(
+        writer,
+        ('insert', order(user_id=1)),
+        ('insert', order(user_id=None)),
+        ('insert', order(user_id=3)),
+    )
+    assert isinstance(bad.exception(), IntegrityError)
+    assert {good_before.result(), good_after.result()} == {order.id for order in db.session.query(db.Order)}
+
+
+def test_status_race_in_one_batch_has_one_winner(db, writer):
+    order_id = db.add_order(**order())
+    first, second = commit(
+        writer,
+        ('status', {'order_id': order_id, 'status': 'printed', 'printed_by': 1, 'expected_version': 0}),
+        ('status', {'order_id': order_id, 'status': 'printed', 'printed_by': 2, 'expected_version': 0}),
+    )
+    assert (first.result(), second.result()) == (True, False)
+    saved = db.get_order(order_id)
+    assert (saved.status, saved.printed_by, saved.version) == ('printed', 1, 1)
+
+
+def test_stale_version_is_rejected(db, writer):
+    order_id = db.add_order(**order())
+    assert writer.update_order_status(order_id, 'confirmed', expected_version=0).result(timeout=5)
+    assert not writer.update_order_status(order_id, 'printed', expected_version=0).result(timeout=5)
+    assert db.get_order(order_id).status == 'confirmed'
+
+
+def test_cancelled_write_is_skipped(db, writer):
+    kept = writer.add_order(**order(user_id=1))
+    cancelled = writer.add_order(**order(user_id=2))
+    # Поток ждёт соседей interval_ms — запись ещё не начата
+    assert cancelled.cancel()
+    kept_id = kept.result(timeout=5)
+    writer.close()
+    assert [(o.id, o.user_id) for o in db.session.query(db.Order)] == [(kept_id, 1)]
+
+
+def test_shared_session_sees_writer_updates(db, writer):
+    order_id = db.add_order(**order())
+    held = db.get_order(order_id)
+    assert writer.update_order_status(order_id, 'confirmed', expected_version=0).result(timeout=5)
+    # Объект из identity map общей сессии перечитывается, а не возвращается со старым статусом
+    assert (db.get_order(order_id).status, held.version) == ('confirmed', 1)
+    assert [o.status for o in db.get_orders()] == ['confirmed']
@@ -0,0 +1,104 @@
+import asyncio
+
+import pytest
+
+import printer_client
+from printer_client import CircuitBreaker, PrinterClient, PrinterUnavailable
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(printer_client.time, 'monotonic', clock)
+    return clock
+
+
+def test_breaker_opens_after_threshold(clock):
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=30)
+    for _ in range(2):
+        assert breaker.allow()
+        breaker.record_failure()
+    assert breaker.state == 'closed'
+    breaker.record_failure()
+    assert breaker.state == 'open'
+    assert not breaker.allow()
+
+
+def test_breaker_half_open_then_closed(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    breaker.record_failure()
+    clock.now += 29
+    assert not breaker.allow()
+    clock.now += 1
+    assert breaker.allow()
+    assert breaker.state == 'half_open'
+    # Пока идёт пробный запрос, остальные сразу получают отказ
+    assert not breaker.allow()
+    assert breaker.record_success()
+    assert breaker.state == 'closed'
+    assert breaker.allow()
+
+
+def test_failed_probe_reopens_breaker(clock):
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=30)
+    for _ in range(3):
+        breaker.record_failure()
+    clock.now += 30
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == 'open'
+    assert not breaker.allow()
+
+
+class Response:
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+def test_client_fails_fast_when_printer_is_down(clock):
+    client = PrinterClient(base_url='http://printer', api_key='key', failure_threshold=2, reset_timeout=30)
+    calls = []
+
+    def post(receipt_data, headers):
+        calls.append(receipt_data)
+        return Response(503)
+
+    client._post = post
+
+    async def scenario():
+        for _ in range(2):
+            assert (await client.print_receipt({'order_id': 1})).status_code == 503
+        with pytest.raises(PrinterUnavailable):
+            await client.print_receipt({'order_id': 1})
+
+    asyncio.run(scenario())
+    assert len(calls) == 2
+
+
+def test_parked_print_is_replayed_after_recovery(clock):
+    client = PrinterClient(base_url='http://printer', api_key='key', failure_threshold=1, reset_timeout=30)
+    client._health = lambda: Response(200)
+    replayed = []
+
+    async def job():
+        replayed.append(1)
+
+    async def scenario():
+        client.breaker.record_failure()
+        client.park(1, job)
+        assert await client.probe()
+        # Отложенная печать запускается отдельной задачей
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+
+    asyncio.run(scenario())
+    assert replayed == [1]
+    assert client.breaker.state == 'closed'
@@ -0,0 +1,88 @@
+import asyncio
+import logging
+import time
+
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.flags import get_flag
+
+import config
+
+logger = logging.getLogger(__name__)
+
+
+class Debouncer:
+    """Откладывает действие по ключу: из серии быстрых вызовов выполняется только последний"""
+
+    def __init__(self, delay):
+        self.delay = delay
+        self._pending = {}
+
+    def schedule(self, key, action):
+        """action — корутинная функция без аргументов, выполняется через delay секунд"""
+        self.cancel(key)
+        task = asyncio.create_task(self._run(key, action))
+        self._pending[key] = (task, action)
+
+    def cancel(self, key):
+        pending = self._pending.pop(key, None)
+        if pending:
+            pending[0].cancel()
+
+    async def flush(self, key=None):
+        """Немедленно выполняет отложенное действие по key или, без key, все отложенные действия"""
+        if key is None:
+            pending, self._pending = self._pending, {}
+        else:
+            pending = {key: self._pending.pop(key)} if key in self._pending else {}
+        for task, action in pending.values():
+            task.cancel()
+            await self._call(action)
+
+    async def _run(self, key, action):
+        await asyncio.sleep(self.delay)
+        if self._pending.get(key, (None,))[0] is asyncio.current_task():
+            del self._pending[key]
+        await self._call(action)
+
+    async def _call(self, action):
+        try:
+            await action()
+        except Exception as e:
+            logger.error(f"Debounced action error: {e}")
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """Отбрасывает повторные нажатия одной и той же кнопки одним пользователем чаще, чем раз в interval.
+
+    Обработчики с флагом throttling="debounce" сами объединяют быстрые нажатия и не отбрасываются.
+    Любое другое нажатие на сообщение отменяет отложенную перерисовку этого сообщения.
+    """
+
+    def __init__(self, debouncer, interval=None):
+        self.debouncer = debouncer
+        self.interval = interval if interval is not None else config.Config.CALLBACK_THROTTLE_SECONDS
+        self._last_seen = {}
+        self._last_cleanup = time.monotonic()
+
+    def _cleanup(self, now):
+        if now - self._last_cleanup < 60:
+            return
+        self._last_cleanup = now
+        self._last_seen = {key: seen for key, seen in self._last_seen.items() if now - seen < self.interval}
+
+    async def __call__(self, handler, event, data):
+        if get_flag(data, 'throttling') == 'debounce':
+            return await handler(event, data)
+
+        now = time.monotonic()
+        self._cleanup(now)
+        key = (event.from_user.id, event.data)
+        last = self._last_seen.get(key)
+        self._last_seen[key] = now
+        if last is not None and now - last < self.interval:
+            await event.answer("⏳ Подождите, запрос уже обрабатывается")
+            return None
+
+        if event.message:
+            self.debouncer.cancel((event.message.chat.id, event.message.message_id))
+        return await handler(event, data)
@@ -0,0 +1,171 @@
+"""Трассировка заказа от нажатия кнопки до печати чека.
+
+Каждый апдейт бота получает trace id. Он передаётся на сервер печати в заголовке
+X-Trace-Id и сохраняется в outbox вместе с сообщением для канала. Участки (спаны) —
+обработчик, запросы к БД, пост в канал, запрос к принтеру, подключение к принтеру
+и отправка чека — пишутся JSON-строками в файл TRACE_LOG_FILE.
+
+Разбор по заказам:
+    python tracing.py traces.jsonl [printer_traces.jsonl] [--order 42]
+"""
+import argparse
+import contextvars
+import json
+import logging
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime, timezone
+
+import config
+from metrics import _handler_name
+
+TRACE_HEADER = 'X-Trace-Id'
+
+logger = logging.getLogger('trace')
+
+_trace_id = contextvars.ContextVar('trace_id', default=None)
+_service = 'bot'
+# Спаны пишутся, только если configure() подключил файл TRACE_LOG_FILE
+_enabled = False
+# Спаны идут только в свой файл, а не в общий лог (даже при LOG_LEVEL=DEBUG)
+logger.propagate = False
+
+
+def new_trace_id():
+    return uuid.uuid4().hex[:16]
+
+
+def get_trace_id():
+    return _trace_id.get()
+
+
+def set_trace_id(trace_id):
+    """Делает trace_id текущим; возвращает токен для reset_trace_id"""
+    return _trace_id.set(trace_id)
+
+
+def reset_trace_id(token):
+    _trace_id.reset(token)
+
+
+def enabled():
+    return _enabled
+
+
+def record_span(name, duration, started_at=None, trace_id=None, **attrs):
+    """Записывает завершённый спан длительностью duration секунд"""
+    if not enabled():
+        return
+    started_at = started_at if started_at is not None else time.time() - duration
+    record = {
+        'ts': datetime.fromtimestamp(started_at, timezone.utc).isoformat(),
+        'trace_id': trace_id or get_trace_id(),
+        'service': _service,
+        'span': name,
+        'duration_ms': round(duration * 1000, 3),
+    }
+    record.update(attrs)
+    logger.debug(json.dumps(record, ensure_ascii=False, default=str))
+
+
+class span:
+    """Контекстный менеджер: `with span('printer.request', order_id=1) as s: s.attrs['status'] = 200`"""
+
+    def __init__(self, name, trace_id=None, **attrs):
+        self.name = name
+        self.trace_id = trace_id
+        self.attrs = attrs
+
+    def __enter__(self):
+        self._started_at = time.time()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc is not None:
+            self.attrs['error'] = f"{exc_type.__name__}: {exc}"
+        record_span(self.name, time.perf_counter() - self._start, self._started_at, self.trace_id, **self.attrs)
+        return False
+
+
+class TracingMiddleware:
+    """Inner-middleware aiogram: trace id на каждый апдейт и спан обработчика.
+
+    Время ожидания в очереди воркера берётся из data['enqueued_at'] (его ставит
+    ShardedUpdateMiddleware).
+    """
+
+    async def __call__(self, handler, event, data):
+        token = set_trace_id(new_trace_id())
+        data['trace_id'] = get_trace_id()
+        try:
+            attrs = {'handler': _handler_name(data), 'user_id': getattr(event.from_user, 'id', None)}
+            enqueued_at = data.get('enqueued_at')
+            if enqueued_at is not None:
+                attrs['queued_ms'] = round((time.perf_counter() - enqueued_at) * 1000, 3)
+            with span('handler', **attrs):
+                return await handler(event, data)
+        finally:
+            reset_trace_id(token)
+
+
+def configure(service, path=None):
+    """Включает запись спанов сервиса service в JSON-lines файл (TRACE_LOG_FILE)"""
+    global _service, _enabled
+    _service = service
+    path = path or config.Config.TRACE_LOG_FILE
+    if not path or _enabled:
+        return
+    from logging_setup import file_handler, queued
+    # Файл пишет фоновый поток, спаны уже в формате JSON
+    logger.addHandler(queued(file_handler(path, logging.Formatter('%(message)s'))))
+    logger.setLevel(logging.DEBUG)
+    _enabled = True
+
+
+def load_spans(paths):
+    spans = []
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    spans.append(json.loads(line))
+    return spans
+
+
+def order_breakdown(spans):
+    """{order_id: [спаны всех трасс, в которых встречается этот заказ, по времени]}"""
+    by_trace = defaultdict(list)
+    traces_by_order = defaultdict(set)
+    for record in spans:
+        by_trace[record.get('trace_id')].append(record)
+        if record.get('order_id') is not None:
+            traces_by_order[int(record['order_id'])].add(record.get('trace_id'))
+
+    breakdown = {}
+    for order_id, trace_ids in traces_by_order.items():
+        records = [record for trace_id in trace_ids for record in by_trace[trace_id]]
+        breakdown[order_id] = sorted(records, key=lambda record: record['ts'])
+    return dict(sorted(breakdown.items()))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Разбор времени по заказам из файлов трассировки")
+    parser.add_argument('paths', nargs='+', help="JSON-lines файлы TRACE_LOG_FILE бота и сервера печати")
+    parser.add_argument('--order', type=int, help="Показать только этот заказ")
+    args = parser.parse_args()
+
+    breakdown = order_breakdown(load_spans(args.paths))
+    if args.order is not None:
+        breakdown = {args.order: breakdown.get(args.order, [])}
+    for order_id, records in breakdown.items():
+        print(f"Заказ #{order_id}")
+        for record in records:
+            extra = {key: value for key, value in record.items()
+                     if key not in ('ts', 'trace_id', 'service', 'span', 'duration_ms', 'order_id')}
+            details = ' '.join(f"{key}={value}" for key, value in extra.items())
+            print(f"  {record['ts'][11:23]}  {record['trace_id']}  {record['service']:<8}"
+                  f"{record['span']:<24}{record['duration_ms']:>10.1f} мс  {details}")
+        print()
@@ -0,0 +1,74 @@
+import asyncio
+import logging
+import time
+
+import config
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class ShardedUpdateMiddleware:
+    """Outer-middleware для dp.update: раскладывает апдейты по воркерам по from_user.id.
+
+    Апдейты одного пользователя всегда попадают к одному воркеру и обрабатываются
+    по порядку, разные пользователи обрабатываются параллельно (не больше workers
+    одновременно). Когда очередь воркера заполнена, приём новых апдейтов ждёт —
+    поэтому polling нужно запускать с handle_as_tasks=False.
+    """
+
+    def __init__(self, workers=None, queue_size=None):
+        self.workers = workers or config.Config.UPDATE_WORKERS
+        self.queue_size = queue_size or config.Config.UPDATE_QUEUE_SIZE
+        self._queues = []
+        self._tasks = []
+
+    def _ensure_started(self):
+        if self._tasks:
+            return
+        for shard in range(self.workers):
+            queue = asyncio.Queue(maxsize=self.queue_size)
+            self._queues.append(queue)
+            self._tasks.append(asyncio.create_task(self._worker(shard, queue)))
+
+    @staticmethod
+    def _shard_key(event, data):
+        user = data.get('event_from_user')
+        if user is not None:
+            return user.id
+        chat = data.get('event_chat')
+        if chat is not None:
+            return chat.id
+        return event.update_id
+
+    async def __call__(self, handler, event, data):
+        self._ensure_started()
+        shard = self._shard_key(event, data) % self.workers
+        metrics.UPDATE_QUEUE_DEPTH.inc()
+        # По этой отметке TracingMiddleware считает время ожидания в очереди
+        data['enqueued_at'] = time.perf_counter()
+        # put ждёт, если очередь заполнена — это и есть backpressure для polling
+        await self._queues[shard].put((handler, event, data))
+
+    async def _worker(self, shard, queue):
+        while True:
+            handler, event, data = await queue.get()
+            metrics.UPDATE_QUEUE_DEPTH.dec()
+            try:
+                await handler(event, data)
+            except Exception as e:
+                logger.exception(f"Update {event.update_id} failed in worker {shard}: {e}")
+            finally:
+                queue.task_done()
+
+    async def join(self):
+        """Ждёт, пока все принятые апдейты будут обработаны"""
+        for queue in self._queues:
+            await queue.join()
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queues = []